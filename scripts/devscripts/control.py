@@ -17,16 +17,22 @@
 """This module implements facilities to deal with Debian control."""
 
 import os
+import re
 import sys
 
 from devscripts.logger import Logger
 
-try:
-    import debian.deb822
-except ImportError:
-    Logger.error(
-        "Please install 'python3-debian' in order to use this utility.")
-    sys.exit(1)
+
+def _deb822():
+    """Returns the debian.deb822 module, which is slow to import and only
+       needed when the fast parser below gives up."""
+    try:
+        import debian.deb822  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        Logger.error(
+            "Please install 'python3-debian' in order to use this utility.")
+        sys.exit(1)
+    return debian.deb822
 
 
 def _insert_after(paragraph, item_before, new_item, new_value):
@@ -60,16 +66,253 @@ def _insert_after(paragraph, item_before, new_item, new_value):
         paragraph[new_item] = new_value
 
 
+_FIELD_RE = re.compile(r"^(?P<key>[^: \t\n\r\f\v]+)\s*:\s*(?P<data>.*?)\s*$", re.DOTALL)
+
+
+def _dump_field(key, value):
+    """Format a field the same way as debian.deb822 does"""
+    if not value or value[0] == "\n":
+        return "%s:%s\n" % (key, value)
+    return "%s: %s\n" % (key, value)
+
+
+class ControlParagraph:
+    """A paragraph of a control file that keeps its original text
+
+       The lines are only split into fields when a field is accessed and
+       dump() only re-serializes the fields that were changed. All other
+       fields, including their comments, are returned exactly as read. The
+       comments of a changed field are kept and moved before it.
+       Field names are case-insensitive like in debian.deb822."""
+
+    def __init__(self, lines):
+        self._lines = lines
+        # lower case name -> [name, original lines or None if changed, value,
+        # comments before a changed field]
+        self._fields = None
+        self._tail = []
+        self._changed = False
+
+    def _parse(self):
+        if self._fields is not None:
+            return
+        self._fields = {}
+        # parse_control() makes sure that the first line is not a continuation
+        field = ["", [], None, []]
+        comments = []
+        for line in self._lines:
+            if line.startswith("#"):
+                comments.append(line)
+            elif line[0].isspace():
+                field[1].extend(comments)
+                field[1].append(line)
+                comments = []
+            else:
+                key = line.split(":", 1)[0].strip()
+                field = [key, comments + [line], None, []]
+                if key.lower() in self._fields:
+                    # like debian.deb822, only keep the last duplicate
+                    self._changed = True
+                self._fields[key.lower()] = field
+                comments = []
+        self._tail = comments
+
+    @staticmethod
+    def _value(lines):
+        value = None
+        for line in lines:
+            if line.startswith("#"):
+                continue
+            if value is None:
+                value = _FIELD_RE.match(line).group("data")
+            else:
+                value += "\n" + line.rstrip("\r\n")
+        return value
+
+    def __getitem__(self, key):
+        self._parse()
+        field = self._fields[key.lower()]
+        if field[2] is None:
+            field[2] = self._value(field[1])
+        return field[2]
+
+    def _rewrite(self, field, value):
+        if field[1] is not None:
+            field[3] = [line for line in field[1] if line.startswith("#")]
+            field[1] = None
+        field[2] = value
+        self._changed = True
+
+    def __setitem__(self, key, value):
+        self._parse()
+        field = self._fields.get(key.lower())
+        if field is not None and self[key] == value:
+            return
+        if field is None:
+            self._fields[key.lower()] = [key, None, value, []]
+            self._changed = True
+        else:
+            self._rewrite(field, value)
+
+    def __delitem__(self, key):
+        self._parse()
+        del self._fields[key.lower()]
+        self._changed = True
+
+    def __contains__(self, key):
+        self._parse()
+        return key.lower() in self._fields
+
+    def __iter__(self):
+        self._parse()
+        return iter([field[0] for field in self._fields.values()])
+
+    def __len__(self):
+        self._parse()
+        return len(self._fields)
+
+    def get(self, key, default=None):
+        """Returns the value of the field or default if it does not exist."""
+        return self[key] if key in self else default
+
+    def order_after(self, field, reference_field):
+        """Moves field directly after reference_field"""
+        self._parse()
+        if reference_field.lower() not in self._fields:
+            raise KeyError(reference_field)
+        moved = self._fields.pop(field.lower())
+        fields = {}
+        for key, value in self._fields.items():
+            fields[key] = value
+            if key == reference_field.lower():
+                fields[field.lower()] = moved
+        self._fields = fields
+        self._changed = True
+
+    def normalize(self):
+        """Re-serializes the fields that debian.deb822 would format
+           differently, like "Section : devel" or "Standards-Version:4.6.0"."""
+        self._parse()
+        for field in self._fields.values():
+            if field[1] is None:
+                continue
+            value = self[field[0]]
+            lines = [line for line in field[1] if not line.startswith("#")]
+            if "".join(lines) != _dump_field(field[0], value):
+                self._rewrite(field, value)
+
+    def strip_trailing_spaces(self):
+        """Strips the trailing spaces of all lines, including comments."""
+        if self._fields is None:
+            self._lines = [line.rstrip() + "\n" for line in self._lines]
+            return
+        for field in self._fields.values():
+            if field[1] is not None:
+                field[1] = [line.rstrip() + "\n" for line in field[1]]
+                field[2] = None
+            else:
+                field[2] = "\n".join(line.rstrip() for line in field[2].split("\n"))
+                field[3] = [line.rstrip() + "\n" for line in field[3]]
+        self._tail = [line.rstrip() + "\n" for line in self._tail]
+        self._changed = True
+
+    def dump(self):
+        """Returns the paragraph as text."""
+        if not self._changed:
+            return "".join(self._lines)
+        text = []
+        for key, lines, value, comments in self._fields.values():
+            if lines is None:
+                text.extend(comments)
+                text.append(_dump_field(key, value))
+            else:
+                text.extend(lines)
+        text.extend(self._tail)
+        return "".join(text)
+
+
+def _has_fields(lines):
+    return any(not line.startswith("#") for line in lines)
+
+
+def parse_control(content):
+    """Splits the content of a control file into ControlParagraph objects
+
+       Returns the paragraphs and the text between them (blank lines and
+       comments). Returns None if the content needs the full parser from
+       debian.deb822, for example if it is PGP signed."""
+    if content and not content.endswith("\n"):
+        return None
+    paragraphs = []
+    separators = []
+    separator = []
+    lines = []
+    for line in content.splitlines(keepends=True) + ["\n"]:
+        if line in ("\n", "\r\n"):
+            if _has_fields(lines):
+                separators.append("".join(separator))
+                paragraphs.append(ControlParagraph(lines))
+                separator = []
+            else:
+                separator.extend(lines)
+            separator.append(line)
+            lines = []
+        elif line.startswith("#"):
+            lines.append(line)
+        elif line[0].isspace():
+            # a continuation line needs a field before it
+            if line.isspace() or not _has_fields(lines):
+                return None
+            lines.append(line)
+        elif _FIELD_RE.match(line) and not line.startswith("-----"):
+            lines.append(line)
+        else:
+            return None
+    # drop the blank line added above to end the last paragraph
+    separator.pop()
+    separators.append("".join(separator))
+    return paragraphs, separators
+
+
 class Control:
     """Represents a debian/control file"""
 
     def __init__(self, filename):
         assert os.path.isfile(filename), "%s does not exist." % (filename)
         self.filename = filename
-        self.paragraphs = []
-        with open(filename, encoding="utf8") as sequence:
-            for paragraph in debian.deb822.Deb822.iter_paragraphs(sequence):
-                self.paragraphs.append(paragraph)
+        with open(filename, encoding="utf8") as control_file:
+            self.content = control_file.read()
+        parsed = parse_control(self.content)
+        if parsed is None:
+            # Fall back to python-debian which drops comments and
+            # normalizes the formatting
+            self.paragraphs = list(_deb822().Deb822.iter_paragraphs(
+                self.content.splitlines(keepends=True)))
+            self.separators = None
+        else:
+            self.paragraphs, self.separators = parsed
+
+    def dump(self):
+        """Returns the content of the control file."""
+        if self.separators is None or len(self.separators) != len(self.paragraphs) + 1:
+            return "\n".join([x.dump() for x in self.paragraphs])
+        content = [self.separators[0]]
+        for paragraph, separator in zip(self.paragraphs, self.separators[1:]):
+            content.append(paragraph.dump())
+            content.append(separator)
+        return "".join(content)
+
+    def normalize(self):
+        """Formats the fields and the blank lines between the paragraphs like
+           debian.deb822 does, but keeps the comments."""
+        for paragraph in self.paragraphs:
+            if isinstance(paragraph, ControlParagraph):
+                paragraph.normalize()
+        if self.separators is not None:
+            last = len(self.separators) - 1
+            self.separators = [
+                separator if "#" in separator else "" if i in (0, last) else "\n"
+                for i, separator in enumerate(self.separators)]
 
     def get_maintainer(self):
         """Returns the value of the Maintainer field."""
@@ -83,7 +326,7 @@ class Control:
         """Saves the control file."""
         if filename:
             self.filename = filename
-        content = "\n".join([x.dump() for x in self.paragraphs])
+        content = self.dump()
         with open(self.filename, "wb") as control_file:
             control_file.write(content.encode("utf-8"))
 
@@ -101,7 +344,13 @@ class Control:
 
     def strip_trailing_spaces(self):
         """Strips all trailing spaces from the control file."""
+        if self.separators is not None:
+            self.separators = ["".join(line.rstrip() + "\n" for line in x.splitlines())
+                               for x in self.separators]
         for paragraph in self.paragraphs:
+            if isinstance(paragraph, ControlParagraph):
+                paragraph.strip_trailing_spaces()
+                continue
             for item in paragraph:
                 lines = paragraph[item].split("\n")
                 paragraph[item] = "\n".join([line.rstrip() for line in lines])
@@ -12,6 +12,8 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
+import importlib.machinery
+import importlib.util
 import inspect
 import os
 import sys
@@ -53,6 +55,18 @@ def get_source_files():
     return files
 
 
+def load_script(script):
+    """Import one of the SCRIPTS as a module without running its main()"""
+    path = script
+    if not os.path.exists(path):  # pragma: no cover
+        path = os.path.join(os.environ.get("OLDPWD", ""), script)
+    loader = importlib.machinery.SourceFileLoader(script.replace("-", "_"), path)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
 def unittest_verbosity():
     """Return the verbosity setting of the currently running unittest
     program, or None if none is running.
@@ -0,0 +1,474 @@
+# benchmark.py - Benchmark the Python scripts without network access.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""benchmark.py - Benchmark the Python scripts without network access
+
+Run it from the scripts directory:
+
+    python3 -m devscripts.test.benchmark [--size large] [--output FILE] [NAME...]
+
+snapshot.debian.org and metasnap.debian.net are replaced by the stand-in of
+devscripts.test.snapshot serving a synthetic archive, and the rate limits of
+the scripts are lifted, so that the results measure the scripts and not the
+network. The generated data only depends on the size, so the JSON results of
+different versions of devscripts can be compared.
+"""
+
+import argparse
+import bz2
+import contextlib
+import functools
+import http.client
+import io
+import json
+import lzma
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest.mock
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from . import load_script
+from .snapshot import SyntheticArchive, serve
+
+# the version of the JSON output, increase it when its meaning changes
+FORMAT_VERSION = 1
+
+SIZES = {
+    "small": {
+        "packages": 40,
+        "timestamps": 16,
+        "deb_size": 32 * 1024,
+        "jobs": 4,
+        "binaries": 50,
+        "installed": 2000,
+        "builds": 20000,
+    },
+    "large": {
+        "packages": 2000,
+        "timestamps": 64,
+        "deb_size": 512 * 1024,
+        "jobs": 8,
+        "binaries": 1000,
+        "installed": 50000,
+        "builds": 500000,
+    },
+}
+
+# the rate limits of the scripts are set to this, so that they never wait
+UNLIMITED = 1e12
+
+
+class Skip(Exception):
+    """The benchmark cannot run here, the message says why"""
+
+
+@functools.lru_cache(maxsize=None)
+def load(script):
+    """load_script(), but raise Skip if the script cannot be imported"""
+    stderr = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(stderr):
+            return load_script(script)
+    except ImportError as e:
+        raise Skip("%s cannot be imported: %s" % (script, e)) from e
+    except SystemExit as e:
+        raise Skip("%s cannot be imported: %s"
+                   % (script, stderr.getvalue().strip().splitlines()[0])) from e
+
+
+def result(seconds, items, numbytes=None):
+    """Return the entry of one measurement in the results"""
+    entry = {
+        "seconds": round(seconds, 6),
+        "items": items,
+        "items_per_second": round(items / seconds, 1),
+    }
+    if numbytes is not None:
+        entry["bytes"] = numbytes
+        entry["bytes_per_second"] = round(numbytes / seconds)
+    return entry
+
+
+def synthetic_archive(size):
+    return SyntheticArchive(size["packages"], size["timestamps"], size["deb_size"])
+
+
+def deb_paths(archive):
+    """Return the paths of the .deb files at the last timestamp of archive,
+    mapped to their size"""
+    index = len(archive.timestamps) - 1
+    return {
+        "/archive/debian/%s/%s" % (archive.timestamps[index],
+                                   archive.pool_path(package, version)):
+        archive.deb_info(package, version)[0]
+        for package, version in archive.packages_at(index)
+    }
+
+
+def fetch(port, paths, jobs):
+    """GET the paths from the server at port, with jobs concurrent
+    connections, check their size and return the number of bytes received"""
+
+    def get(path):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            body = response.read()
+        finally:
+            conn.close()
+        assert response.status == 200, "%s: HTTP %d" % (path, response.status)
+        assert len(body) == paths[path], "%s: got %d of %d bytes" % (
+            path, len(body), paths[path])
+        return len(body)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return sum(executor.map(get, paths))
+
+
+@contextlib.contextmanager
+def snapshot_environment(archive):
+    """Serve archive and send the requests for snapshot.debian.org to it"""
+    with serve(archive) as httpd, unittest.mock.patch.dict(
+        os.environ, {"http_proxy": httpd.url, "no_proxy": "127.0.0.1,localhost"}
+    ):
+        # urlopen() keeps using the proxy settings it found first
+        urllib.request.install_opener(None)
+        try:
+            yield httpd
+        finally:
+            urllib.request.install_opener(None)
+
+
+def debbisect_proxy(size, tmpdir):
+    debbisect = load("debbisect")
+    archive = synthetic_archive(size)
+    paths = deb_paths(archive)
+    throttle = debbisect.Throttle
+    with snapshot_environment(archive), unittest.mock.patch.object(
+        debbisect, "Throttle", lambda _: throttle(UNLIMITED)
+    ):
+        port, _, _, teardown = debbisect.setupcache(os.path.join(tmpdir, "cache"), 0)
+        results = {}
+        try:
+            # the second time, everything comes from the cache
+            for name in ("cold", "cached"):
+                started = time.perf_counter()
+                received = fetch(port, paths, size["jobs"])
+                results["debbisect.proxy." + name] = result(
+                    time.perf_counter() - started, len(paths), received)
+        finally:
+            teardown()
+    return results
+
+
+def debbisect_first_seen_by_pkg(size, tmpdir):
+    debbisect = load("debbisect")
+    archive = synthetic_archive(size)
+    # every package exists from the middle of the history on
+    begin = archive.dates[len(archive.dates) // 2]
+    packages = [("src:" if i % 2 else "") + package
+                for i, package in enumerate(archive.uploads)]
+    results = {}
+    with snapshot_environment(archive) as httpd:
+        index = debbisect.SnapshotIndex(tmpdir)
+        client = debbisect.SnapshotClient(tmpdir, httpd.url, size["jobs"], UNLIMITED)
+        # the second time, the indices and most answers come from the cache
+        for name in ("cold", "cached"):
+            received = httpd.bytes
+            started = time.perf_counter()
+            timestamps = debbisect.first_seen_by_pkg(
+                packages, begin, archive.dates[-1], archive.suite, archive.architecture,
+                index, client)
+            results["debbisect.first_seen_by_pkg." + name] = result(
+                time.perf_counter() - started, len(packages), httpd.bytes - received)
+            assert timestamps
+    return results
+
+
+@contextlib.contextmanager
+def unlimited_debootsnap(debootsnap):
+    with unittest.mock.patch.multiple(
+        debootsnap.Proxy,
+        request_limiter=debootsnap.TokenBucket(UNLIMITED, UNLIMITED),
+        byte_limiter=debootsnap.TokenBucket(UNLIMITED, UNLIMITED),
+    ):
+        yield
+
+
+def debootsnap_proxy(size, tmpdir):
+    debootsnap = load("debootsnap")
+    archive = synthetic_archive(size)
+    paths = deb_paths(archive)
+    with snapshot_environment(archive), unlimited_debootsnap(debootsnap), \
+            debootsnap.proxy_snapshot(tmpdir) as port:
+        started = time.perf_counter()
+        received = fetch(port, paths, size["jobs"])
+        return {"debootsnap.proxy": result(time.perf_counter() - started, len(paths),
+                                           received)}
+
+
+def metasnap_packages(archive):
+    """Return a version of every package of archive, as debootsnap wants it"""
+    rng = random.Random(0)
+    return [(package, archive.architecture, rng.choice(uploads)[0])
+            for package, uploads in archive.uploads.items()]
+
+
+def debootsnap_compute_sources(size, tmpdir):
+    debootsnap = load("debootsnap")
+    archive = synthetic_archive(size)
+    pkgs = metasnap_packages(archive)
+    results = {}
+    with snapshot_environment(archive) as httpd, unittest.mock.patch.object(
+        debootsnap, "METASNAP_URL", httpd.url + "/cgi-bin/api"
+    ):
+        cache = debootsnap.MetasnapCache(os.path.join(tmpdir, "metasnap.sqlite"))
+        debootsnap.compute_sources(pkgs, archive.architecture, False, cache)
+        for name, cache in (("cold", None), ("cached", cache)):
+            started = time.perf_counter()
+            sources = debootsnap.compute_sources(pkgs, archive.architecture, False, cache)
+            results["debootsnap.compute_sources." + name] = result(
+                time.perf_counter() - started, len(pkgs))
+            assert sources
+    return results
+
+
+def apt_get_update(env):
+    """Stand in for apt-get update: fetch the Release and Packages files of
+    the sources.list configured in env, without checking signatures"""
+    output = subprocess.check_output(
+        ["apt-get", "indextargets", "--no-release-info", "--format",
+         "$(FILENAME)\t$(URI)\t$(BASE_URI)\t$(METAKEY)", "Created-By: Packages"],
+        env=env, text=True)
+    # the URIs point to the debootsnap proxy, which is not reached via proxy
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    for line in output.splitlines():
+        filename, uri, base_uri, metakey = line.split("\t")
+        with opener.open(uri + ".xz") as f, open(filename, "wb") as out:
+            out.write(lzma.decompress(f.read()))
+        with opener.open(base_uri + "Release") as f, open(
+            filename[: -len(metakey)] + "Release", "wb"
+        ) as out:
+            out.write(f.read())
+
+
+def debootsnap_download_packages(size, tmpdir):
+    # The synthetic archive is not signed by a key apt trusts and the
+    # signature check needs mmdebstrap, so only apt-get update is replaced.
+    # Packages missing from the Packages lists are an error, instead of a
+    # job for apt-get download.
+    if shutil.which("apt-get") is None:
+        raise Skip("apt-get is not installed")
+    debootsnap = load("debootsnap")
+    archive = synthetic_archive(size)
+    pkgs = metasnap_packages(archive)
+    check_call = subprocess.check_call
+
+    def apt_get(args, **kwargs):
+        if args[:2] == ["apt-get", "update"]:
+            return apt_get_update(kwargs["env"])
+        assert args[:2] != ["apt-get", "download"], "%s is not in the Packages lists" % args
+        return check_call(args, **kwargs)
+
+    with snapshot_environment(archive) as httpd, unittest.mock.patch.object(
+        debootsnap, "METASNAP_URL", httpd.url + "/cgi-bin/api"
+    ), unlimited_debootsnap(debootsnap), unittest.mock.patch.object(
+        subprocess, "check_call", apt_get
+    ):
+        sources = debootsnap.compute_sources(pkgs, archive.architecture, False)
+        received = httpd.bytes
+        started = time.perf_counter()
+        debootsnap.download_packages(tmpdir, sources, pkgs, archive.architecture, set(),
+                                     size["jobs"])
+        elapsed = time.perf_counter() - started
+        assert len(os.listdir(os.path.join(tmpdir, "cache"))) == len(pkgs)
+        return {"debootsnap.download_packages": result(elapsed, len(pkgs),
+                                                       httpd.bytes - received)}
+
+
+def write_debian_directory(debian, numbinaries):
+    """Write a debian directory with numbinaries binary packages with long
+    Depends and .install files, none of them wrapped and sorted"""
+    rng = random.Random(0)
+    libraries = ["lib%s%d" % (rng.choice(["foo", "bar", "baz"]), i) for i in range(200)]
+    os.makedirs(debian)
+    paragraphs = [
+        "Source: synthetic\nSection: misc\nPriority: optional\n"
+        "Maintainer: Synthetic Maintainer <synthetic@example.org>\n"
+        "Build-Depends: %s, debhelper-compat (= 13)\nStandards-Version: 4.6.2\n"
+        % ", ".join(library + "-dev" for library in rng.sample(libraries, 30))
+    ]
+    binaries = ["synthetic%d" % i for i in range(numbinaries)]
+    rng.shuffle(binaries)
+    for binary in binaries:
+        depends = ["%s (>= 1.%d)" % (library, rng.randrange(10))
+                   for library in rng.sample(libraries, 12)]
+        paragraphs.append(
+            "Package: %s\nArchitecture: amd64 any\n"
+            "Depends: %s, ${misc:Depends}, ${shlibs:Depends}\n"
+            "Description: synthetic binary package\n"
+            " This package was generated to benchmark wrap-and-sort.\n"
+            % (binary, ", ".join(depends)))
+        lines = ["usr/lib/%s/file%d" % (binary, i) for i in range(20)]
+        rng.shuffle(lines)
+        with open(os.path.join(debian, binary + ".install"), "w", encoding="utf8") as f:
+            f.write("\n".join(lines) + "\n")
+    with open(os.path.join(debian, "control"), "w", encoding="utf8") as f:
+        f.write("\n".join(paragraphs))
+
+
+def wrap_and_sort_process_tree(size, tmpdir):
+    wrap_and_sort = load("wrap-and-sort")
+    debian = os.path.join(tmpdir, "debian")
+    write_debian_directory(debian, size["binaries"])
+    with unittest.mock.patch.object(
+        sys, "argv", ["wrap-and-sort", "-a", "-b", "-t", "--dry-run", "-d", debian]
+    ):
+        args = wrap_and_sort.parse_args()
+    files = wrap_and_sort.get_files(debian)
+    started = time.perf_counter()
+    modified_files, _ = wrap_and_sort.process_tree(debian, args)
+    elapsed = time.perf_counter() - started
+    assert len(modified_files) == len(files)
+    return {"wrap-and-sort.process_tree": result(
+        elapsed, len(files), sum(os.path.getsize(f) for f in files))}
+
+
+def write_reproducible_data(tmpdir, size):
+    """Write the build results of reproducible-builds.org and a dpkg status
+    file, with many packages of the results installed"""
+    rng = random.Random(0)
+    architectures = ["amd64", "arm64", "i386"]
+    builds = [
+        {"package": "src%d" % (i // 6), "version": "1.%d-1" % (i % 2),
+         "architecture": architectures[i % 3], "suite": "unstable",
+         "status": rng.choice(["reproducible"] * 4 + ["FTBR", "FTBFS"])}
+        for i in range(size["builds"])
+    ]
+    json_path = os.path.join(tmpdir, "reproducible.json.bz2")
+    with open(json_path, "wb") as f:
+        f.write(bz2.compress(json.dumps(builds).encode()))
+    status = []
+    for i in range(size["installed"]):
+        source = "src%d" % rng.randrange(size["builds"] // 6)
+        status.append(
+            "Package: bin%d\nStatus: install ok installed\nPriority: optional\n"
+            "Architecture: %s\nSource: %s\nVersion: 1.%d-1%s\n"
+            "Description: synthetic binary package\n multi-line description\n"
+            % (i, rng.choice(["amd64", "all"]), source, rng.randrange(2),
+               rng.choice(["", "+b1"])))
+    status_path = os.path.join(tmpdir, "status")
+    with open(status_path, "w", encoding="utf8") as f:
+        f.write("\n".join(status))
+    return json_path, status_path
+
+
+def reproducible_check(size, tmpdir):
+    reproducible_check_module = load("reproducible-check")
+    index_class = reproducible_check_module.ReproducibleIndex
+    json_path, status_path = write_reproducible_data(tmpdir, size)
+    results = {}
+
+    index_path = os.path.join(tmpdir, "reproducible.sqlite")
+    started = time.perf_counter()
+    with open(json_path, "rb") as f:
+        index_class.build(index_path, f, {})
+    results["reproducible-check.build"] = result(
+        time.perf_counter() - started, size["builds"], os.path.getsize(json_path))
+
+    started = time.perf_counter()
+    with open(status_path, encoding="utf8") as f:
+        installed = reproducible_check_module.read_dpkg_status(f)
+    results["reproducible-check.read_dpkg_status"] = result(
+        time.perf_counter() - started, len(installed), os.path.getsize(status_path))
+
+    started = time.perf_counter()
+    index = index_class(index_path, in_memory=True)
+    unreproducible = [
+        binary for (binary, architecture, version), source in sorted(installed.items())
+        if (source, "amd64" if architecture == "all" else architecture, version) not in index
+    ]
+    results["reproducible-check.lookup"] = result(
+        time.perf_counter() - started, len(installed))
+    assert 0 < len(unreproducible) < len(installed)
+    return results
+
+
+BENCHMARKS = {
+    "debbisect.proxy": debbisect_proxy,
+    "debbisect.first_seen_by_pkg": debbisect_first_seen_by_pkg,
+    "debootsnap.proxy": debootsnap_proxy,
+    "debootsnap.compute_sources": debootsnap_compute_sources,
+    "debootsnap.download_packages": debootsnap_download_packages,
+    "wrap-and-sort.process_tree": wrap_and_sort_process_tree,
+    "reproducible-check": reproducible_check,
+}
+
+
+def run(size="small", names=None):
+    """Run the benchmarks with the given names, or all of them, and return
+    the report"""
+    report = {
+        "format": FORMAT_VERSION,
+        "size": size,
+        "parameters": SIZES[size],
+        "python": platform.python_version(),
+        "results": {},
+        "skipped": {},
+    }
+    for name in names or BENCHMARKS:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                # the scripts print progress and the proxies log requests
+                with contextlib.redirect_stdout(io.StringIO()), \
+                        contextlib.redirect_stderr(io.StringIO()):
+                    report["results"].update(BENCHMARKS[name](SIZES[size], tmpdir))
+            except Skip as e:
+                report["skipped"][name] = str(e)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python3 -m devscripts.test.benchmark",
+        description="Benchmark the Python scripts against a local stand-in for "
+        "snapshot.debian.org and write the results as JSON.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small",
+                        help="size of the generated data (default: %(default)s)")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="write the results to FILE instead of standard output")
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help="run only these benchmarks: %s" % ", ".join(BENCHMARKS))
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(unknown))
+    text = json.dumps(run(args.size, args.names), indent=2, sort_keys=True) + "\n"
+    if args.output is None:
+        sys.stdout.write(text)
+    else:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
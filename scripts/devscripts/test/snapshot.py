@@ -0,0 +1,367 @@
+# snapshot.py - Local stand-in for snapshot.debian.org and metasnap.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""snapshot.py - Serve a synthetic archive like snapshot.debian.org does
+
+The server answers requests for /archive/debian/<timestamp>/..., the /mr/
+JSON API and the metasnap.debian.net API at /cgi-bin/api. Requests sent to
+it as an HTTP proxy, with an absolute URL, are answered the same way, so
+that code with a hardcoded http://snapshot.debian.org/ can be pointed at it
+with the http_proxy environment variable.
+"""
+
+import bisect
+import contextlib
+import datetime
+import email.parser
+import email.utils
+import hashlib
+import http.server
+import json
+import lzma
+import random
+import re
+import threading
+import urllib.parse
+
+TIMESTAMP_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def read_form(handler):
+    """Return the fields of the multipart/form-data POST request handled by
+    handler, as sent by requests.post(url, files=...)"""
+    length = int(handler.headers["Content-Length"])
+    message = email.parser.BytesParser().parsebytes(
+        b"Content-Type: "
+        + handler.headers["Content-Type"].encode()
+        + b"\r\n\r\n"
+        + handler.rfile.read(length)
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload()
+        for part in message.get_payload()
+    }
+
+
+class SyntheticArchive:
+    """A made-up history of the main component of unstable on amd64
+
+    Every source package is uploaded one to four times and builds a binary
+    package of the same name and version. All packages exist from the middle
+    of the history on. The .deb files are generated from their name and
+    version when they are requested.
+    """
+
+    suite = "unstable"
+    architecture = "amd64"
+
+    def __init__(self, numpkgs, numtimestamps, debsize, seed=0):
+        rng = random.Random(seed)
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self.dates = [start + datetime.timedelta(hours=6 * i) for i in range(numtimestamps)]
+        self.timestamps = [date.strftime(TIMESTAMP_FORMAT) for date in self.dates]
+        # package -> [(version, index of the timestamp it was uploaded at)]
+        self.uploads = {}
+        for i in range(numpkgs):
+            first = rng.randrange(numtimestamps // 2 + 1)
+            later = rng.sample(range(first + 1, numtimestamps),
+                               min(rng.randint(0, 3), numtimestamps - first - 1))
+            self.uploads["pkg%d" % i] = [
+                ("1.%d-1" % j, index) for j, index in enumerate([first] + sorted(later))
+            ]
+        self.debsize = debsize
+        self.lock = threading.Lock()
+        self.files = {}
+        self.debinfo = {}
+
+    def timestamp_index(self, timestamp):
+        """Return the index of the last timestamp not after timestamp, as
+        snapshot.debian.org redirects to it, or None"""
+        index = bisect.bisect_right(self.timestamps, timestamp) - 1
+        return index if index >= 0 else None
+
+    def packages_at(self, index):
+        """Return the (package, version) pairs in the archive at the
+        timestamp with the given index"""
+        result = []
+        for package, uploads in self.uploads.items():
+            versions = [version for version, uploaded in uploads if uploaded <= index]
+            if versions:
+                result.append((package, versions[-1]))
+        return result
+
+    def ranges(self, package):
+        """Return (version, first timestamp, last timestamp) of every version
+        of package"""
+        uploads = self.uploads[package]
+        result = []
+        for i, (version, uploaded) in enumerate(uploads):
+            last = uploads[i + 1][1] - 1 if i + 1 < len(uploads) else len(self.timestamps) - 1
+            result.append((version, self.timestamps[uploaded], self.timestamps[last]))
+        return result
+
+    def pool_path(self, package, version):
+        return "pool/main/%s/%s/%s_%s_%s.deb" % (
+            package[0], package, package, version, self.architecture)
+
+    def deb(self, package, version):
+        """Return the content of the .deb file of package in version"""
+        seed = hashlib.sha256(("%s_%s" % (package, version)).encode()).digest()
+        size = self.debsize // 2 + int.from_bytes(seed[:4], "big") % self.debsize
+        return (seed * (size // len(seed) + 1))[:size]
+
+    def deb_info(self, package, version):
+        """Return the size and the SHA256 of the .deb file of package in
+        version"""
+        key = (package, version)
+        if key not in self.debinfo:
+            deb = self.deb(package, version)
+            self.debinfo[key] = (len(deb), hashlib.sha256(deb).hexdigest())
+        return self.debinfo[key]
+
+    def _packages(self, index, architecture):
+        if architecture != self.architecture:
+            return b""
+        paragraphs = []
+        for package, version in self.packages_at(index):
+            size, sha256 = self.deb_info(package, version)
+            paragraphs.append(
+                "Package: %s\nVersion: %s\nArchitecture: %s\n"
+                "Maintainer: Synthetic Maintainer <synthetic@example.org>\n"
+                "Filename: %s\nSize: %d\nSHA256: %s\n"
+                "Description: synthetic package %s\n"
+                % (package, version, self.architecture, self.pool_path(package, version),
+                   size, sha256, package))
+        return "\n".join(paragraphs).encode()
+
+    def _sources(self, index):
+        paragraphs = []
+        for package, version in self.packages_at(index):
+            paragraphs.append(
+                "Package: %s\nBinary: %s\nVersion: %s\nArchitecture: any\n"
+                "Directory: pool/main/%s/%s\n"
+                % (package, package, version, package[0], package))
+        return "\n".join(paragraphs).encode()
+
+    def _release(self, index):
+        lines = [
+            "Origin: Debian",
+            "Label: Debian",
+            "Suite: %s" % self.suite,
+            "Codename: sid",
+            "Date: %s" % email.utils.format_datetime(self.dates[index]),
+            "Architectures: %s" % self.architecture,
+            "Components: main",
+            "SHA256:",
+        ]
+        for name in ("main/binary-all/Packages", "main/binary-%s/Packages" % self.architecture,
+                     "main/source/Sources"):
+            for suffix in ("", ".xz"):
+                content = self.index_file(index, name + suffix)
+                lines.append(" %s %d %s%s" % (hashlib.sha256(content).hexdigest(),
+                                              len(content), name, suffix))
+        return ("\n".join(lines) + "\n").encode()
+
+    def index_file(self, index, name):
+        """Return the content of dists/<suite>/<name> at the timestamp with
+        the given index, or None if there is no such file"""
+        key = (index, name)
+        with self.lock:
+            if key in self.files:
+                return self.files[key]
+        if name.endswith(".xz"):
+            content = self.index_file(index, name[:-3])
+            if content is not None:
+                content = lzma.compress(content)
+        elif name == "Release":
+            content = self._release(index)
+        elif name == "main/source/Sources":
+            content = self._sources(index)
+        else:
+            match = re.fullmatch(r"main/binary-([a-z0-9-]+)/Packages", name)
+            content = self._packages(index, match[1]) if match else None
+        with self.lock:
+            self.files[key] = content
+        return content
+
+    def _fileinfo(self, package, version, name):
+        uploaded = dict(self.uploads[package])[version]
+        return {
+            "archive_name": "debian",
+            "first_seen": self.timestamps[uploaded],
+            "name": name,
+            "path": "/pool/main/%s/%s" % (package[0], package),
+            "size": self.deb_info(package, version)[0] if name.endswith(".deb") else 1024,
+        }
+
+    def mr(self, path):
+        """Return the answer of the machine-readable API to path, or None"""
+        match = re.fullmatch(r"/mr/(package|binary)/([^/]+)/", path)
+        if match and match[2] in self.uploads:
+            versions = [version for version, _ in reversed(self.uploads[match[2]])]
+            if match[1] == "package":
+                result = [{"version": version} for version in versions]
+            else:
+                result = [{"name": match[2], "binary_version": version, "source": match[2],
+                           "version": version} for version in versions]
+            return {"_comment": "foo", match[1]: match[2], "result": result}
+        match = re.fullmatch(r"/mr/(package|binary)/([^/]+)/([^/]+)/(allfiles|binfiles)", path)
+        if (not match or match[2] not in self.uploads
+                or match[3] not in dict(self.uploads[match[2]])
+                or (match[1], match[4]) not in [("package", "allfiles"),
+                                                ("binary", "binfiles")]):
+            return None
+        package, version = match[2], match[3]
+        dsc = "%s_%s.dsc" % (package, version)
+        deb = self.pool_path(package, version).rsplit("/", 1)[1]
+        dschash = hashlib.sha1(dsc.encode()).hexdigest()
+        debhash = hashlib.sha1(deb.encode()).hexdigest()
+        fileinfo = {dschash: [self._fileinfo(package, version, dsc)],
+                    debhash: [self._fileinfo(package, version, deb)]}
+        if match[1] == "binary":
+            del fileinfo[dschash]
+            return {"_comment": "foo", "binary": package, "binary_version": version,
+                    "result": [{"architecture": self.architecture, "hash": debhash}],
+                    "fileinfo": fileinfo}
+        binaries = [{"name": package, "version": version,
+                     "files": [{"architecture": self.architecture, "hash": debhash}]}]
+        return {"_comment": "foo", "package": package, "version": version,
+                "result": {"source": [{"hash": dschash}], "binaries": binaries},
+                "fileinfo": fileinfo}
+
+    def get(self, path):
+        """Return the content and the content type of the file at path, or
+        None"""
+        match = re.fullmatch(r"/archive/debian/(\d{8}T\d{6}Z)/(.+)", path)
+        if match:
+            index = self.timestamp_index(match[1])
+            if index is None:
+                return None
+            rest = match[2]
+            if rest.startswith("dists/%s/" % self.suite):
+                content = self.index_file(index, rest[len("dists/%s/" % self.suite):])
+                return None if content is None else (content, "application/octet-stream")
+            match = re.fullmatch(r"pool/main/[^/]+/([^/]+)/\1_([^_]+)_([a-z0-9-]+)\.deb", rest)
+            if (match and match[1] in self.uploads and match[3] == self.architecture
+                    and match[2] in dict(self.uploads[match[1]])):
+                return self.deb(match[1], match[2]), "application/vnd.debian.binary-package"
+            return None
+        answer = self.mr(path)
+        if answer is None:
+            return None
+        return json.dumps(answer).encode(), "application/json"
+
+    def metasnap(self, archive, architecture, pkgs):
+        """Return the status and the text of the metasnap answer for the
+        (package, architecture, version) triplets in pkgs"""
+        known = {}
+        for n, a, v in pkgs:
+            if (archive, architecture, a) != ("debian", self.architecture, self.architecture):
+                continue
+            for version, first, last in self.ranges(n) if n in self.uploads else []:
+                if version == v:
+                    known[(n, a, v)] = " ".join((n, a, v, self.suite, "main", first, last))
+        missing = [nav for nav in pkgs if nav not in known]
+        if missing:
+            return 404, "".join("%s %s %s\n" % nav for nav in missing)
+        return 200, "".join(known[nav] + "\n" for nav in pkgs)
+
+
+class SnapshotHandler(http.server.BaseHTTPRequestHandler):
+    # the debootsnap proxy wants to see "HTTP/1.1 200 OK"
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, which would make
+    # keep-alive connections wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = self.path
+        if not path.startswith("/"):
+            # the request was sent to the server as a proxy
+            path = urllib.parse.urlsplit(path).path
+        path = "/" + path.split("?", 1)[0].lstrip("/")
+        answer = self.server.archive.get(path)
+        if answer is None:
+            self.send_error(404)
+            return
+        content, content_type = answer
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match and int(match[1]) < len(content):
+            start = int(match[1])
+            self.send_response(206)
+            self.send_header("Content-Range",
+                             "bytes %d-%d/%d" % (start, len(content) - 1, len(content)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content) - start))
+        self.send_header("Last-Modified",
+                         email.utils.format_datetime(self.server.archive.dates[0], usegmt=True))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content[start:])
+            self.server.count(len(content) - start)
+
+    do_HEAD = do_GET
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        fields = read_form(self)
+        pkgs = []
+        for pkg in fields["pkgs"].split(","):
+            n, rest = pkg.split(":")
+            a, v = rest.split("=")
+            pkgs.append((n, a, v))
+        status, text = self.server.archive.metasnap(fields["archive"], fields["arch"], pkgs)
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body))
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class SnapshotServer(http.server.ThreadingHTTPServer):
+    """Serve archive on a free port of 127.0.0.1, the base URL is in the url
+    attribute"""
+
+    def __init__(self, archive):
+        super().__init__(("127.0.0.1", 0), SnapshotHandler)
+        self.archive = archive
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def count(self, numbytes):
+        with self.lock:
+            self.requests += 1
+            self.bytes += numbytes
+
+
+@contextlib.contextmanager
+def serve(archive):
+    """Run a SnapshotServer for archive in a thread while the block runs"""
+    httpd = SnapshotServer(archive)
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        server_thread.join()
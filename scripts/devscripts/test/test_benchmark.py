@@ -0,0 +1,78 @@
+# test_benchmark.py - Run the offline benchmarks with small data.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_benchmark.py - Check the stand-in for snapshot.debian.org and the
+results of the benchmarks"""
+
+import json
+import lzma
+import sys
+import unittest
+import urllib.error
+import urllib.request
+
+from . import unittest_verbosity
+from .benchmark import BENCHMARKS, FORMAT_VERSION, SIZES, run
+from .snapshot import SyntheticArchive, serve
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def test_archive(self):
+        archive = SyntheticArchive(10, 8, 1024)
+        ts = archive.timestamps[-1]
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        with serve(archive) as httpd:
+
+            def get(path):
+                with opener.open(httpd.url + path) as f:
+                    return f.read()
+
+            packages = lzma.decompress(
+                get("/archive/debian/%s/dists/unstable/main/binary-amd64/Packages.xz" % ts))
+            self.assertEqual(packages.count(b"Package: "), 10)
+            # a later timestamp is redirected to the last one before it
+            self.assertEqual(
+                get("/archive/debian/20990101T000000Z/dists/unstable/main/binary-amd64/"
+                    "Packages"), packages)
+            package, version = archive.packages_at(len(archive.timestamps) - 1)[0]
+            deb = get("/archive/debian/%s/%s" % (ts, archive.pool_path(package, version)))
+            self.assertEqual(len(deb), archive.deb_info(package, version)[0])
+            versions = json.loads(get("/mr/package/%s/" % package))["result"]
+            self.assertEqual(versions[0]["version"], version)
+            with self.assertRaises(urllib.error.HTTPError):
+                get("/mr/package/missing/")
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_small(self):
+        report = run("small")
+        self.assertEqual(report["format"], FORMAT_VERSION)
+        self.assertEqual(report["parameters"], SIZES["small"])
+        # the report is written with sorted keys, so it has to survive that
+        self.assertEqual(json.loads(json.dumps(report, sort_keys=True)), report)
+        self.assertEqual(
+            sorted({name for name in BENCHMARKS if name in report["skipped"]}
+                   | {name for name in BENCHMARKS for result in report["results"]
+                      if result.startswith(name)}),
+            sorted(BENCHMARKS))
+        for name, result in report["results"].items():
+            self.assertGreater(result["seconds"], 0, name)
+            self.assertGreater(result["items"], 0, name)
+        if unittest_verbosity() >= 2:
+            for name, result in sorted(report["results"].items()):
+                sys.stderr.write("\n%s: %.3f s, %.1f items/s"
+                                 % (name, result["seconds"], result["items_per_second"]))
+            for name, reason in sorted(report["skipped"].items()):
+                sys.stderr.write("\n%s: skipped, %s" % (name, reason))
+            sys.stderr.write("\n")
@@ -0,0 +1,184 @@
+# test_control.py - Test devscripts.control.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_control.py - Test and benchmark devscripts.control"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import debian.deb822
+
+from devscripts.control import Control, parse_control
+
+from . import unittest_verbosity
+
+SAMPLE = """\
+# a comment before the source paragraph
+Source: foo
+Maintainer: Jane Doe <jane@example.org>
+Build-Depends: debhelper-compat (= 13),
+               zlib1g-dev
+Standards-Version: 4.6.0
+
+# the library
+Package: libfoo1
+Architecture: any
+# the dependencies
+Depends: ${shlibs:Depends},
+ ${misc:Depends}
+Description: foo library
+ Long description.
+ .
+ More text.\x20
+
+Package: foo-bin
+Architecture: amd64 any-i386
+Depends:b,a
+Description: foo tools
+"""
+
+
+def large_control(packages):
+    """Returns a debian/control file with the given number of binary packages"""
+    content = [
+        "Source: big\nMaintainer: Jane Doe <jane@example.org>\n"
+        "Build-Depends: debhelper-compat (= 13), %s\n"
+        % ", ".join("libdep%d-dev" % i for i in range(50))
+    ]
+    for i in range(packages):
+        content.append(
+            "Package: big%d\nArchitecture: any\n"
+            "Depends: ${shlibs:Depends}, ${misc:Depends}, big-common (= ${binary:Version})\n"
+            "Description: big package %d\n This is the package number %d.\n .\n"
+            " It only exists for the benchmark.\n" % (i, i, i)
+        )
+    return "\n".join(content)
+
+
+class ControlTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, content):
+        filename = os.path.join(self.tmpdir.name, "control")
+        with open(filename, "w", encoding="utf8") as f:
+            f.write(content)
+        return filename
+
+    def test_round_trip(self):
+        control = Control(self.write(SAMPLE))
+        self.assertIsNotNone(control.separators)
+        self.assertEqual(control.dump(), SAMPLE)
+
+    def test_values(self):
+        control = Control(self.write(SAMPLE))
+        expected = list(debian.deb822.Deb822.iter_paragraphs(SAMPLE.splitlines()))
+        self.assertEqual(len(control.paragraphs), len(expected))
+        for paragraph, reference in zip(control.paragraphs, expected):
+            self.assertEqual(list(paragraph), list(reference))
+            for field in reference:
+                self.assertEqual(paragraph[field], reference[field])
+        self.assertEqual(control.paragraphs[1]["depends"], expected[1]["Depends"])
+
+    def test_modify(self):
+        control = Control(self.write(SAMPLE))
+        control.paragraphs[2]["Depends"] = "a, b"
+        control.paragraphs[1]["Architecture"] = "any"
+        self.assertEqual(
+            control.dump(),
+            SAMPLE.replace("Depends:b,a\n", "Depends: a, b\n"))
+        control.set_original_maintainer("John Doe <john@example.org>")
+        self.assertEqual(control.get_original_maintainer(), "John Doe <john@example.org>")
+        self.assertIn(
+            "Maintainer: Jane Doe <jane@example.org>\n"
+            "XSBC-Original-Maintainer: John Doe <john@example.org>\n"
+            "Build-Depends:", control.dump())
+
+    def test_modify_comments(self):
+        control = Control(self.write(SAMPLE.replace(
+            "               zlib1g-dev\n",
+            "# old-dep,\n               zlib1g-dev\n")))
+        control.paragraphs[0]["Build-Depends"] = "debhelper-compat (= 13), zlib1g-dev"
+        control.paragraphs[1]["Depends"] = "${misc:Depends}, ${shlibs:Depends}"
+        # the comments of a rewritten field are moved before it
+        self.assertEqual(
+            control.dump(),
+            SAMPLE.replace(
+                "Build-Depends: debhelper-compat (= 13),\n               zlib1g-dev\n",
+                "# old-dep,\nBuild-Depends: debhelper-compat (= 13), zlib1g-dev\n",
+            ).replace(
+                "Depends: ${shlibs:Depends},\n ${misc:Depends}\n",
+                "Depends: ${misc:Depends}, ${shlibs:Depends}\n",
+            ))
+
+    def test_normalize(self):
+        content = ("\nSource: foo\nMaintainer:   Jane <j@e.org>\n"
+                   "Standards-Version:4.6.0\n# the section\nSection : devel\n"
+                   "Build-Depends:\n a,\n b\n\n\n\nPackage: foo\nDescription:  x\n y\n\n")
+        control = Control(self.write(content))
+        control.normalize()
+        self.assertEqual(
+            control.dump(),
+            "Source: foo\nMaintainer: Jane <j@e.org>\nStandards-Version: 4.6.0\n"
+            "# the section\nSection: devel\nBuild-Depends:\n a,\n b\n\n"
+            "Package: foo\nDescription: x\n y\n")
+        # everything else, including the comments, is left alone
+        control = Control(self.write(SAMPLE))
+        control.normalize()
+        self.assertEqual(control.dump(), SAMPLE.replace("Depends:b,a", "Depends: b,a"))
+
+    def test_strip_trailing_spaces(self):
+        control = Control(self.write(SAMPLE.replace("Source: foo", "Source: foo  ")))
+        control.strip_trailing_spaces()
+        self.assertEqual(control.dump(), SAMPLE.replace("More text. ", "More text."))
+
+    def test_fallback(self):
+        signed = ("-----BEGIN PGP SIGNED MESSAGE-----\nHash: SHA256\n\n"
+                  + SAMPLE + "-----BEGIN PGP SIGNATURE-----\n\nabc\n"
+                  "-----END PGP SIGNATURE-----\n")
+        self.assertIsNone(parse_control(signed))
+        self.assertIsNone(parse_control(" continuation\n"))
+        control = Control(self.write(signed))
+        self.assertIsNone(control.separators)
+        self.assertEqual(control.paragraphs[0]["Source"], "foo")
+
+    def test_benchmark(self):
+        filename = self.write(large_control(500))
+
+        started = time.perf_counter()
+        reference = Control.__new__(Control)
+        with open(filename, encoding="utf8") as f:
+            reference.paragraphs = list(debian.deb822.Deb822.iter_paragraphs(f))
+        reference.paragraphs[-1]["Architecture"] = "all"
+        reference_dump = "\n".join([x.dump() for x in reference.paragraphs])
+        deb822_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        control = Control(filename)
+        parsed = time.perf_counter()
+        control.paragraphs[-1]["Architecture"] = "all"
+        modified = time.perf_counter()
+        dump = control.dump()
+        finished = time.perf_counter()
+
+        self.assertEqual(dump, reference_dump)
+        if unittest_verbosity() >= 2:
+            sys.stderr.write(
+                "500 binary packages: parse %.4f s, modify %.4f s, dump %.4f s "
+                "(deb822: %.4f s)\n"
+                % (parsed - started, modified - parsed, finished - modified, deb822_time))
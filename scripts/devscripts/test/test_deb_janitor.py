@@ -0,0 +1,269 @@
+# test_deb_janitor.py - Test the bulk modes of deb-janitor.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See file /usr/share/common-licenses/GPL-3 for more details.
+
+"""test_deb_janitor.py - Test deb-janitor against a local Janitor API"""
+
+import functools
+import hashlib
+import http.server
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from . import load_script
+
+deb_janitor = load_script("deb-janitor")
+
+
+class JanitorHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in for the Janitor API
+
+    The server has a "diffs" attribute mapping (suite, source) to the diff,
+    and counts the "connections" and "requests" it handled. The package
+    "slow" is answered after "delay" seconds. If "drop" is set, every
+    connection is closed after one response without announcing it.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def send(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.server.drop:
+            self.close_connection = True
+
+    def parse(self, action):
+        with self.server.lock:
+            self.server.requests += 1
+        _, api, suite, pkg, source, path_action = self.path.split("/")
+        assert (api, pkg, path_action) == ("api", "pkg", action), self.path
+        return suite, source
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        suite, source = self.parse("schedule")
+        if source == "slow":
+            time.sleep(self.server.delay)
+        if (suite, source) not in self.server.diffs:
+            self.send(404, json.dumps({"reason": "no such source: %s" % source}).encode())
+            return
+        self.send(200, json.dumps({
+            "estimated_duration_seconds": 60.0,
+            "queue_position": len(source),
+            "queue_wait_time": 0.0,
+        }).encode())
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        suite, source = self.parse("diff")
+        data = self.server.diffs.get((suite, source))
+        if data is None:
+            self.send(404, b"no diff for %s" % source.encode())
+            return
+        etag = '"%s"' % hashlib.sha256(data).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send(304, b"", [("ETag", etag)])
+            return
+        self.send(200, data, [("ETag", etag)])
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class DebJanitorTestCase(unittest.TestCase):
+    def setUp(self):
+        httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), JanitorHandler)
+        httpd.daemon_threads = True
+        httpd.lock = threading.Lock()
+        httpd.connections = 0
+        httpd.requests = 0
+        httpd.delay = 0
+        httpd.drop = False
+        httpd.diffs = {
+            ("lintian-fixes", "pkg%d" % i): b"--- a/debian/control\n+++ b/debian/control\n%d\n" % i
+            for i in range(50)
+        }
+        server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        server_thread.start()
+        self.addCleanup(server_thread.join)
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        self.httpd = httpd
+        self.api_url = "http://127.0.0.1:%d/api/" % httpd.server_address[1]
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        patcher = unittest.mock.patch.dict(os.environ, {"no_proxy": "127.0.0.1"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bulk(self, function, sources, jobs=4):
+        output = io.StringIO()
+        failed = deb_janitor.run_bulk(function, sources, jobs, output)
+        return failed, [json.loads(line) for line in output.getvalue().splitlines()]
+
+    def test_read_sources(self):
+        self.assertEqual(
+            list(deb_janitor.read_sources(io.StringIO("pkg1\n\n# comment\n pkg2 # too\n"))),
+            ["pkg1", "pkg2"])
+
+    def test_bulk_schedule(self):
+        client = deb_janitor.JanitorClient(self.api_url)
+        self.addCleanup(client.close)
+        sources = ["pkg%d" % i for i in range(50)] + ["missing"]
+        failed, results = self.bulk(
+            lambda source: deb_janitor.bulk_schedule(client, source, "lintian-fixes"),
+            sources)
+        self.assertEqual(failed, 1)
+        self.assertEqual([result["source"] for result in results], sources)
+        self.assertEqual(results[3]["status"], "scheduled")
+        self.assertEqual(results[3]["queue_position"], 4)
+        self.assertEqual(results[-1], {"source": "missing", "suite": "lintian-fixes",
+                                       "status": "error", "error": "no such source: missing"})
+        # one connection per worker thread
+        self.assertEqual(self.httpd.requests, 51)
+        self.assertLessEqual(self.httpd.connections, 4)
+
+    def test_bulk_diff_cache(self):
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        client = deb_janitor.JanitorClient(self.api_url, cache_dir=cache_dir)
+        self.addCleanup(client.close)
+        sources = ["pkg%d" % i for i in range(50)] + ["missing"]
+
+        def bulk_diff(source):
+            return deb_janitor.bulk_diff(client, source, "lintian-fixes")
+
+        failed, results = self.bulk(bulk_diff, sources)
+        self.assertEqual(failed, 1)
+        self.assertEqual(results[7]["diff"],
+                         "--- a/debian/control\n+++ b/debian/control\n7\n")
+        self.assertFalse(results[7]["cached"])
+        self.assertEqual(results[-1]["status"], "missing")
+
+        self.httpd.diffs[("lintian-fixes", "pkg7")] = b"changed\n"
+        failed, second = self.bulk(bulk_diff, sources)
+        self.assertEqual(failed, 1)
+        self.assertEqual([result.get("cached") for result in second[:50]],
+                         [i != 7 for i in range(50)])
+        self.assertEqual(second[7]["diff"], "changed\n")
+        self.assertEqual(second[8], results[8] | {"cached": True})
+
+        # the cache also serves the single diff command
+        self.assertEqual(
+            deb_janitor.diff("pkg8", "lintian-fixes", self.api_url, cache_dir),
+            b"--- a/debian/control\n+++ b/debian/control\n8\n")
+        with self.assertRaises(deb_janitor.MissingDiffError):
+            deb_janitor.diff("missing", "lintian-fixes", self.api_url, cache_dir)
+
+    def test_diff_uncached(self):
+        # the single diff command has no side effects unless --cache-dir is given
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        for args, expected in (([], None), (["--cache-dir", cache_dir], cache_dir)):
+            output = io.BytesIO()
+            stdout = io.TextIOWrapper(output)
+            with unittest.mock.patch.object(
+                deb_janitor, "JanitorClient", wraps=deb_janitor.JanitorClient
+            ) as client, unittest.mock.patch.object(sys, "stdout", stdout):
+                argv = ["--api-url", self.api_url] + args + ["diff", "pkg1", "lintian-fixes"]
+                self.assertEqual(deb_janitor.main(argv), 0)
+            self.assertEqual(client.call_args.kwargs["cache_dir"], expected)
+            self.assertEqual(output.getvalue(),
+                             self.httpd.diffs[("lintian-fixes", "pkg1")])
+        self.assertEqual(os.listdir(cache_dir), ["lintian-fixes"])
+
+    def test_bulk_diff_output_dir(self):
+        client = deb_janitor.JanitorClient(self.api_url)
+        self.addCleanup(client.close)
+        output_dir = self.tmpdir.name
+        failed, results = self.bulk(
+            lambda source: deb_janitor.bulk_diff(client, source, "lintian-fixes", output_dir),
+            ["pkg1", "pkg2"], jobs=1)
+        self.assertEqual(failed, 0)
+        self.assertEqual(self.httpd.connections, 1)
+        with open(results[1]["path"], "rb") as f:
+            self.assertEqual(f.read(), self.httpd.diffs[("lintian-fixes", "pkg2")])
+
+    def test_invalid_names(self):
+        cache_dir = os.path.join(self.tmpdir.name, "cache")
+        output_dir = os.path.join(self.tmpdir.name, "output")
+        os.mkdir(output_dir)
+        client = deb_janitor.JanitorClient(self.api_url, cache_dir=cache_dir)
+        self.addCleanup(client.close)
+        sources = ["../pkg1", "pkg1/../../pkg2", "/pkg3", "Pkg4", "-pkg5", "p", "pkg6"]
+        self.httpd.diffs.update({("lintian-fixes", name): b"diff\n" for name in sources})
+        for function in (deb_janitor.bulk_diff, deb_janitor.bulk_schedule):
+            failed, results = self.bulk(
+                functools.partial(function, client, suite="lintian-fixes"), sources)
+            self.assertEqual(failed, 6)
+            self.assertEqual([result["status"] for result in results[:-1]], ["error"] * 6)
+            self.assertEqual(results[0]["error"], "invalid source package name")
+        failed, results = self.bulk(
+            functools.partial(deb_janitor.bulk_diff, client, suite="lintian-fixes",
+                              output_dir=output_dir), sources)
+        self.assertEqual(failed, 6)
+        self.assertEqual(os.listdir(output_dir), ["pkg6.diff"])
+        self.assertEqual(os.listdir(self.tmpdir.name), ["cache", "output"])
+        # the suite is checked before it is used in the cache
+        failed, results = self.bulk(
+            functools.partial(deb_janitor.bulk_diff, client, suite="../lintian-fixes"),
+            ["pkg1"])
+        self.assertEqual(failed, 1)
+        self.assertIn("invalid name", results[0]["error"])
+        self.assertEqual(os.listdir(cache_dir), ["lintian-fixes"])
+
+    def test_timeout(self):
+        # the connection of a request that timed out is not used again
+        self.httpd.delay = 2
+        self.httpd.diffs[("lintian-fixes", "slow")] = b""
+        client = deb_janitor.JanitorClient(self.api_url, timeout=0.5)
+        self.addCleanup(client.close)
+        failed, results = self.bulk(
+            lambda source: deb_janitor.bulk_schedule(client, source, "lintian-fixes"),
+            ["slow", "pkg1", "pkg2"], jobs=1)
+        self.assertEqual(failed, 1)
+        self.assertEqual([result["status"] for result in results],
+                         ["error", "scheduled", "scheduled"])
+        self.assertIn("timed out", results[0]["error"])
+        self.assertEqual(self.httpd.connections, 2)
+
+    def test_closed_connection(self):
+        # the server closes every connection after one request
+        self.httpd.drop = True
+        client = deb_janitor.JanitorClient(self.api_url)
+        self.addCleanup(client.close)
+        # a GET is sent again on a new connection
+        failed, _ = self.bulk(
+            lambda source: deb_janitor.bulk_diff(client, source, "lintian-fixes"),
+            ["pkg1", "pkg2"], jobs=1)
+        self.assertEqual(failed, 0)
+        self.assertEqual(self.httpd.requests, 2)
+        # but a POST might have been handled, so it is not repeated
+        failed, results = self.bulk(
+            lambda source: deb_janitor.bulk_schedule(client, source, "lintian-fixes"),
+            ["pkg1", "pkg2"], jobs=1)
+        self.assertEqual(failed, 1)
+        self.assertEqual([result["status"] for result in results], ["scheduled", "error"])
+        self.assertEqual(self.httpd.requests, 3)
@@ -0,0 +1,374 @@
+# test_debbisect.py - Test debbisect.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_debbisect.py - Test the argument checks, the proxy and the snapshot
+clients of debbisect"""
+
+import contextlib
+import datetime
+import http.client
+import http.server
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from . import load_script
+from .snapshot import SyntheticArchive, serve
+
+debbisect = load_script("debbisect")
+
+GOOD = "20230101T000000Z"
+BAD = "20230201T000000Z"
+DEB = "/archive/debian/20230101T000000Z/pool/main/h/hello/hello_1.0-1_amd64.deb"
+
+
+def parseargs(*args, script="true"):
+    with unittest.mock.patch.object(
+        sys, "argv", ["debbisect"] + list(args) + [GOOD, BAD, script]
+    ):
+        return debbisect.parseargs()
+
+
+class ParseargsTestCase(unittest.TestCase):
+    def assert_error(self, message, *args):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr), self.assertRaises(SystemExit):
+            parseargs(*args)
+        self.assertIn(message, stderr.getvalue())
+
+    def test_jobs(self):
+        self.assertEqual(parseargs().jobs, 1)
+        self.assertEqual(parseargs("--jobs", "4").jobs, 4)
+        self.assert_error("at least 1", "--jobs", "0")
+
+    def test_jobs_qemu(self):
+        # concurrent virtual machines would share the disk image and ssh port
+        self.assertIsNotNone(parseargs("--qemu", "defaults").qemu)
+        self.assert_error("--jobs cannot be used together with --qemu",
+                          "--jobs", "2", "--qemu", "defaults")
+
+
+class JournalTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "debbisect.journal")
+        self.script = os.path.join(tmpdir.name, "test.sh")
+        self.write_script("#!/bin/sh\nexit 1\n")
+        self.good = debbisect.datetime(2023, 1, 1, tzinfo=debbisect.timezone.utc)
+        self.bad = debbisect.datetime(2023, 2, 1, tzinfo=debbisect.timezone.utc)
+        self.middle = debbisect.datetime(2023, 1, 16, tzinfo=debbisect.timezone.utc)
+
+    def write_script(self, content):
+        with open(self.script, "w", encoding="utf8") as f:
+            f.write(content)
+
+    def journal(self, *args):
+        test = debbisect.get_test_id(parseargs(*args, script=self.script))
+        return debbisect.Journal(self.path, test)
+
+    def record(self, journal, timestamp, verdict):
+        journal.add(
+            {
+                "timestamp": timestamp.strftime("%Y%m%dT%H%M%SZ"),
+                "upgrade": None,
+                "verdict": verdict,
+            }
+        )
+
+    def test_resume(self):
+        self.record(self.journal(), self.middle, "good")
+        self.assertEqual(
+            self.journal().narrow(self.good, self.bad), (self.middle, self.bad)
+        )
+        self.record(self.journal(), self.middle, "bad")
+        self.assertEqual(
+            self.journal().narrow(self.good, self.bad), (self.good, self.middle)
+        )
+
+    def test_mismatch(self):
+        self.record(self.journal("--depends", "foo"), self.middle, "bad")
+        for args in [(), ("--depends", "bar"), ("--depends", "foo", "--suite", "bookworm")]:
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(
+                    self.journal(*args).narrow(self.good, self.bad), (self.good, self.bad)
+                )
+        self.assertEqual(
+            self.journal("--depends", "foo").narrow(self.good, self.bad),
+            (self.good, self.middle),
+        )
+        # a fixed test script invalidates the earlier verdicts
+        self.write_script("#!/bin/sh\nexit 0\n")
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(
+                self.journal("--depends", "foo").narrow(self.good, self.bad),
+                (self.good, self.bad),
+            )
+
+    def test_old_records(self):
+        # records written before the test was recorded cannot be trusted
+        with open(self.path, "w", encoding="utf8") as f:
+            f.write('{"timestamp": "20230116T000000Z", "upgrade": null, "verdict": "bad"}\n')
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(
+                self.journal().narrow(self.good, self.bad), (self.good, self.bad)
+            )
+
+
+class ChrootCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.directory = os.path.join(tmpdir.name, "chroots")
+        self.early = debbisect.datetime(2023, 1, 1, tzinfo=debbisect.timezone.utc)
+        self.late = debbisect.datetime(2023, 2, 1, tzinfo=debbisect.timezone.utc)
+
+    def cache(self, *args):
+        chroot_id = debbisect.get_chroot_id(parseargs(*args))
+        return debbisect.ChrootCache(self.directory, 1 << 30, chroot_id)
+
+    def test_options(self):
+        cache = self.cache("--depends", "foo")
+        with open(cache.get_path(self.early), "wb"):
+            pass
+        self.assertEqual(cache.acquire(self.late), cache.get_path(self.early))
+        self.assertIsNone(cache.acquire(self.early.replace(day=1, month=1, year=2022)))
+        # chroots of other options are never reused
+        for args in [
+            ("--depends", "bar"),
+            ("--depends", "foo", "--architecture", "arm64"),
+            ("--depends", "foo", "--suite", "bookworm"),
+            ("--depends", "foo", "--components", "main,contrib"),
+        ]:
+            self.assertIsNone(self.cache(*args).acquire(self.late), args)
+        self.assertEqual(
+            self.cache("--depends", "foo").acquire(self.late), cache.get_path(self.early)
+        )
+
+
+class UpstreamHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for snapshot.debian.org, reached as the http_proxy of the
+    debbisect proxy
+
+    If the server's "broken" attribute is set, the connection is closed
+    after a tenth of every body.
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        with self.server.lock:
+            self.server.requests += 1
+        body = self.server.content
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.debian.binary-package")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", "Sun, 01 Jan 2023 00:00:00 GMT")
+        self.end_headers()
+        if self.server.broken:
+            self.wfile.write(body[: len(body) // 10])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class ProxyTestCase(unittest.TestCase):
+    def setUp(self):
+        upstream = http.server.ThreadingHTTPServer(("127.0.0.1", 0), UpstreamHandler)
+        upstream.lock = threading.Lock()
+        upstream.requests = 0
+        upstream.content = os.urandom(256 * 1024)
+        upstream.broken = False
+        upstream_thread = threading.Thread(target=upstream.serve_forever, daemon=True)
+        upstream_thread.start()
+        self.addCleanup(upstream_thread.join)
+        self.addCleanup(upstream.server_close)
+        self.addCleanup(upstream.shutdown)
+        self.upstream = upstream
+        url = "http://127.0.0.1:%d" % upstream.server_address[1]
+        patch = unittest.mock.patch.dict(
+            os.environ, {"http_proxy": url, "no_proxy": "127.0.0.1,localhost"}
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+        # urlopen() keeps using the proxy settings it found first
+        urllib.request.install_opener(None)
+        self.addCleanup(urllib.request.install_opener, None)
+        # errors in the request handlers must not go unnoticed
+        patch = unittest.mock.patch.object(debbisect.ProxyServer, "handle_error")
+        self.handle_error = patch.start()
+        self.addCleanup(patch.stop)
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.port, _, _, teardown = debbisect.setupcache(tmpdir.name, 0)
+        self.addCleanup(teardown)
+
+    def get(self, _=None):
+        """Return the status and the body of DEB through the proxy, None for
+        a body that is shorter than announced"""
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+        try:
+            conn.request("GET", DEB)
+            response = conn.getresponse()
+            try:
+                return response.status, response.read()
+            except http.client.IncompleteRead:
+                return response.status, None
+        finally:
+            conn.close()
+
+    def test_shared_download(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(self.get, range(8)))
+        self.assertEqual(responses, [(200, self.upstream.content)] * 8)
+        self.assertEqual(self.upstream.requests, 1)
+        # then the file comes from the cache
+        self.assertEqual(self.get(), (200, self.upstream.content))
+        self.assertEqual(self.upstream.requests, 1)
+        self.handle_error.assert_not_called()
+
+    def test_failed_download(self):
+        # the readers only get to the download after it has failed, when its
+        # .part file is gone already
+        self.upstream.broken = True
+        stream_download = debbisect.Proxy._stream_download  # pylint: disable=protected-access
+
+        def late_reader(handler, download):
+            with download.cond:
+                download.cond.wait_for(lambda: download.status is not None)
+            stream_download(handler, download)
+
+        with unittest.mock.patch.object(
+            debbisect.Proxy, "_stream_download", late_reader
+        ), unittest.mock.patch.object(debbisect.time, "sleep"), self.assertLogs(
+            level="WARNING"
+        ) as logs, ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(self.get, range(4)))
+        self.assertEqual([status for status, _ in responses], [500] * 4)
+        self.assertIn("try 3 of 3", logs.output[-1])
+        self.handle_error.assert_not_called()
+
+
+class SnapshotTestCase(unittest.TestCase):
+    """Run the local snapshot.debian.org stand-in for every test"""
+
+    def setUp(self):
+        self.archive = SyntheticArchive(20, 8, 1024)
+        server = serve(self.archive)
+        self.httpd = server.__enter__()  # pylint: disable=unnecessary-dunder-call
+        self.addCleanup(server.__exit__, None, None, None)
+        patch = unittest.mock.patch.dict(os.environ, {"no_proxy": "127.0.0.1"})
+        patch.start()
+        self.addCleanup(patch.stop)
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.cachedir = tmpdir.name
+
+
+class SnapshotIndexTestCase(SnapshotTestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = debbisect.SnapshotIndex(self.cachedir, baseurl=self.httpd.url)
+
+    def test_versions(self):
+        index = len(self.archive.timestamps) - 1
+        # between two timestamps, snapshot.debian.org uses the earlier one
+        timestamp = self.archive.dates[index] + datetime.timedelta(hours=1)
+        for package, version in self.archive.packages_at(index):
+            for architecture in ("source", self.archive.architecture):
+                self.assertEqual(
+                    self.index.versions(package, timestamp, "unstable", architecture),
+                    [version],
+                )
+        self.assertEqual(
+            self.index.versions("missing", timestamp, "unstable", "source"), []
+        )
+        # Sources.xz and Packages.xz are only retrieved once
+        self.assertEqual(self.httpd.requests, 2)
+
+    def test_missing_timestamp(self):
+        before = self.archive.dates[0] - datetime.timedelta(days=1)
+        with self.assertRaises(requests.HTTPError):
+            self.index.versions("pkg0", before, "unstable", "source")
+        # a failed download does not leave a partial index behind
+        self.assertEqual(
+            self.index.conn.execute("SELECT COUNT(*) FROM indexed").fetchone(), (0,)
+        )
+
+
+class SnapshotClientTestCase(SnapshotTestCase):
+    def setUp(self):
+        super().setUp()
+        # count the connections the server accepts
+        self.connections = 0
+        process_request = self.httpd.process_request
+
+        def counting_process_request(request, client_address):
+            self.connections += 1
+            process_request(request, client_address)
+
+        self.httpd.process_request = counting_process_request
+
+    def paths(self):
+        return [
+            "/mr/package/%s/%s/allfiles" % (package, version)
+            for package, version in self.archive.packages_at(len(self.archive.timestamps) - 1)
+        ]
+
+    def test_get_json_many(self):
+        client = debbisect.SnapshotClient(
+            self.cachedir, baseurl=self.httpd.url, jobs=3, rate=1000
+        )
+        paths = self.paths()
+        result = client.get_json_many(paths)
+        self.assertEqual(result, {path: self.archive.mr(path) for path in paths})
+        self.assertEqual(self.httpd.requests, len(paths))
+        # the connections are kept open and shared by the jobs
+        self.assertLessEqual(self.connections, 3)
+        # the answers are immutable, so they are only retrieved once, even
+        # by a new client
+        client = debbisect.SnapshotClient(self.cachedir, baseurl=self.httpd.url)
+        self.assertEqual(client.get_json_many(paths), result)
+        self.assertEqual(self.httpd.requests, len(paths))
+        # but not when they are retrieved one by one
+        self.assertEqual(client.get_json(paths[0]), result[paths[0]])
+        self.assertEqual(self.httpd.requests, len(paths) + 1)
+
+    def test_rate(self):
+        client = debbisect.SnapshotClient(
+            self.cachedir, baseurl=self.httpd.url, jobs=4, rate=40
+        )
+        paths = self.paths()[:8]
+        start = time.monotonic()
+        client.get_json_many(paths)
+        # concurrent requests share one limit
+        self.assertGreaterEqual(time.monotonic() - start, (len(paths) - 1) / 40)
+
+    def test_missing(self):
+        client = debbisect.SnapshotClient(self.cachedir, baseurl=self.httpd.url)
+        with self.assertRaises(requests.HTTPError):
+            client.get_json_many(["/mr/package/missing/1.0/allfiles"])
+        self.assertEqual(
+            client.conn.execute("SELECT COUNT(*) FROM responses").fetchone(), (0,)
+        )
@@ -0,0 +1,206 @@
+# test_debdiff_apply.py - Test debdiff-apply.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 3
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See file /usr/share/common-licenses/GPL-3 for more details.
+
+"""test_debdiff_apply.py - Compare the in-process hunk matcher with patch(1)
+and run the batch mode"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import unidiff
+
+from . import load_script
+
+debdiff_apply = load_script("debdiff-apply")
+
+NUMBERS = "".join("%d\n" % i for i in range(1, 201))
+
+
+def write_tree(path, files):
+    for name, content in files.items():
+        filename = os.path.join(path, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w", encoding="utf8") as f:
+            f.write(content)
+
+
+def read_tree(path):
+    contents = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            filename = os.path.join(dirpath, filename)
+            with open(filename, encoding="utf8") as f:
+                contents[os.path.relpath(filename, path)] = f.read()
+    return contents
+
+
+class MatchPatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        old = os.path.join(self.tmpdir.name, "old")
+        new = os.path.join(self.tmpdir.name, "new")
+        write_tree(old, {"numbers": NUMBERS, "gone": "bye\n", "sub/keep": "keep\n"})
+        write_tree(new, {"numbers": NUMBERS.replace("\n5\n", "\nfive\n")
+                                           .replace("\n100\n", "\none hundred\n"),
+                         "sub/added": "new\n", "sub/keep": "keep\n"})
+        # pylint: disable=subprocess-run-check
+        self.diff = subprocess.run(["diff", "-Nru", "old", "new"], cwd=self.tmpdir.name,
+                                   stdout=subprocess.PIPE, text=True).stdout
+        self.patch = unidiff.PatchSet(self.diff)
+        self.addCleanup(os.chdir, os.getcwd())
+
+    def check(self, files, reverse=False):
+        """Apply the patch to a tree of files with match_patch() and with
+        patch(1), return whether match_patch() handled it"""
+        ours = os.path.join(self.tmpdir.name, "ours")
+        theirs = os.path.join(self.tmpdir.name, "theirs")
+        for tree in (ours, theirs):
+            shutil.rmtree(tree, ignore_errors=True)
+            write_tree(tree, files)
+        os.chdir(ours)
+        changes = debdiff_apply.match_patch(self.patch, reverse=reverse)
+        if changes is None:
+            return False
+        debdiff_apply.write_changes(changes)
+        subprocess.run(["patch", "-p1", "-s", "--no-backup-if-mismatch"]
+                       + (["-R"] if reverse else []),
+                       input=self.diff, text=True, cwd=theirs, check=True)
+        self.assertEqual(read_tree(ours), read_tree(theirs))
+        return True
+
+    def test_forward(self):
+        self.assertTrue(self.check({"numbers": NUMBERS, "gone": "bye\n",
+                                    "sub/keep": "keep\n"}))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir.name, "ours", "gone")))
+
+    def test_offset(self):
+        self.assertTrue(self.check({"numbers": "a\nb\nc\n" + NUMBERS[:-4],
+                                    "gone": "bye\n"}))
+
+    def test_reverse(self):
+        applied = os.path.join(self.tmpdir.name, "new")
+        os.chdir(applied)
+        self.assertIsNone(debdiff_apply.match_patch(self.patch))
+        self.assertIsNotNone(debdiff_apply.match_patch(self.patch, reverse=True))
+        self.assertTrue(self.check(read_tree(applied), reverse=True))
+
+    def test_fuzz(self):
+        # patch(1) would apply this with fuzz, which is left to it
+        self.assertFalse(self.check({"numbers": NUMBERS.replace("\n98\n", "\nx\n"),
+                                     "gone": "bye\n"}))
+
+    def test_not_applicable(self):
+        self.assertFalse(self.check({"numbers": "1\n2\n3\n", "gone": "bye\n"}))
+        self.assertFalse(self.check({"numbers": NUMBERS, "gone": "changed\n"}))
+        self.assertFalse(self.check({"numbers": NUMBERS, "gone": "bye\n",
+                                     "sub/added": "different\n"}))
+
+
+CHANGELOG = """\
+foo (%s) unstable; urgency=medium
+
+  * %s
+
+ -- Jane Doe <jane@example.org>  Sun, 01 Jan 2023 00:00:00 +0000
+
+"""
+
+DEBIAN = {
+    "debian/control": "Source: foo\nMaintainer: Jane Doe <jane@example.org>\n\n"
+                      "Package: foo\nArchitecture: all\nDescription: foo\n foo.\n",
+    "debian/source/format": "3.0 (quilt)\n",
+}
+
+
+class BatchTestCase(unittest.TestCase):
+    """Apply one debdiff to several revisions of one upstream version, which
+    share the orig tarball"""
+
+    REVISIONS = ["1.0-%d" % i for i in range(1, 5)]
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        self.src = os.path.join(self.tmpdir.name, "src")
+        upstream = os.path.join(self.src, "foo-1.0")
+        write_tree(upstream, {"hello": "hello\n"})
+        subprocess.run(["tar", "-czf", "foo_1.0.orig.tar.gz", "foo-1.0"],
+                       cwd=self.src, check=True)
+        for version in self.REVISIONS:
+            write_tree(upstream, dict(DEBIAN, **{
+                "debian/changelog": CHANGELOG % (version, "Release %s." % version)}))
+            subprocess.run(["dpkg-source", "-b", "foo-1.0"], cwd=self.src, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        # the debdiff of a change to the first revision
+        old = os.path.join(self.tmpdir.name, "old")
+        new = os.path.join(self.tmpdir.name, "new")
+        changelog = CHANGELOG % (self.REVISIONS[0], "Release %s." % self.REVISIONS[0])
+        write_tree(old, dict(DEBIAN, **{"debian/changelog": changelog}))
+        fixed = CHANGELOG % (self.REVISIONS[0] + "+fix1", "Fix it.") + changelog
+        write_tree(new, dict(DEBIAN, **{"debian/changelog": fixed, "debian/fixed": "yes\n"}))
+        # pylint: disable=subprocess-run-check
+        diff = subprocess.run(["diff", "-Nru", "old", "new"],
+                              cwd=self.tmpdir.name, stdout=subprocess.PIPE).stdout
+        self.patch = os.path.join(self.tmpdir.name, "fix.debdiff")
+        with open(self.patch, "wb") as f:
+            f.write(diff)
+        # dcmd comes from this source tree
+        bindir = os.path.join(self.tmpdir.name, "bin")
+        os.mkdir(bindir)
+        script = os.path.abspath("dcmd.sh")
+        if not os.path.exists(script):  # pragma: no cover
+            script = os.path.join(os.environ.get("OLDPWD", ""), "dcmd.sh")
+        os.symlink(script, os.path.join(bindir, "dcmd"))
+        self.env = dict(os.environ, PATH=bindir + os.pathsep + os.environ["PATH"])
+
+    def run_debdiff_apply(self, *args):
+        script = os.path.abspath("debdiff-apply")
+        if not os.path.exists(script):  # pragma: no cover
+            script = os.path.join(os.environ.get("OLDPWD", ""), "debdiff-apply")
+        out = os.path.join(self.tmpdir.name, "out")
+        os.makedirs(out, exist_ok=True)
+        # pylint: disable=subprocess-run-check
+        return subprocess.run([script] + list(args), cwd=out, env=self.env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+    def test_batch(self):
+        targets = []
+        for version in self.REVISIONS:
+            targets.extend(["--target", os.path.join(self.src, "foo_%s.dsc" % version)])
+        process = self.run_debdiff_apply("-j", "4", "--patch", self.patch, *targets)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        out = os.path.join(self.tmpdir.name, "out")
+        self.assertEqual(
+            sorted(f for f in os.listdir(out) if f.endswith(".dsc")),
+            ["foo_%s+fix1.dsc" % version for version in self.REVISIONS])
+        # with the complete orig tarball
+        check = os.path.join(self.tmpdir.name, "check")
+        os.mkdir(check)
+        for version in self.REVISIONS:
+            tree = os.path.join(check, version)
+            subprocess.run(["dpkg-source", "-x", os.path.join(out, "foo_%s+fix1.dsc" % version),
+                            tree], cwd=check, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.assertEqual(read_tree(tree)["hello"], "hello\n")
+            self.assertEqual(read_tree(tree)["debian/fixed"], "yes\n")
+
+    def test_jobs(self):
+        process = self.run_debdiff_apply("-j", "0", "--patch", self.patch,
+                                         "--target", self.src)
+        self.assertEqual(process.returncode, 2)
+        self.assertIn("--jobs must be at least 1", process.stderr)
@@ -0,0 +1,382 @@
+# test_debootsnap.py - Test the sources.list computation of debootsnap.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_debootsnap.py - Test and benchmark compute_sources()"""
+
+import contextlib
+import datetime
+import http.server
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from . import load_script, unittest_verbosity
+from .snapshot import read_form
+
+debootsnap = load_script("debootsnap")
+
+
+def synthetic_metasnap(numpkgs, numsuites, seed=0):
+    """Return the package list and a metasnap API response for it
+
+    Every package is found in one to four suites in a random timestamp range.
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2015, 1, 1)
+    timestamps = [
+        (start + datetime.timedelta(hours=6 * i)).strftime("%Y%m%dT%H%M%SZ")
+        for i in range(4 * 365 * 5)
+    ]
+    suites = ["suite%d" % i for i in range(numsuites)]
+    pkgs = set()
+    lines = []
+    for i in range(numpkgs):
+        nav = ("pkg%d" % i, "amd64", "1.%d-1" % rng.randrange(10))
+        pkgs.add(nav)
+        for suite in rng.sample(suites, rng.randint(1, 4)):
+            b = rng.randrange(len(timestamps) - 1)
+            e = rng.randrange(b, min(b + 400, len(timestamps)))
+            comp = rng.choice(["main", "main", "main", "contrib", "non-free"])
+            lines.append(
+                " ".join(nav + (suite, comp, timestamps[b], timestamps[e]))
+            )
+    return pkgs, "\n".join(lines) + "\n"
+
+
+class MetasnapHandler(http.server.BaseHTTPRequestHandler):
+    """Local stand-in for the metasnap.debian.net API
+
+    The server has a "known" attribute mapping archive names to the response
+    lines for each package and a "queried" attribute that records the packages
+    of every request.
+    """
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        fields = read_form(self)
+        known = self.server.known.get(fields["archive"], {})
+        pkgs = []
+        for pkg in fields["pkgs"].split(","):
+            n, rest = pkg.split(":")
+            a, v = rest.split("=")
+            pkgs.append((n, a, v))
+        self.server.queried.append((fields["archive"], set(pkgs)))
+        missing = [nav for nav in pkgs if nav not in known]
+        if missing:
+            self.send_response(404)
+            body = "".join("%s %s %s\n" % nav for nav in missing)
+        else:
+            self.send_response(200)
+            body = "".join(known[nav] for nav in pkgs)
+        body = body.encode()
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class DebootsnapTestCase(unittest.TestCase):
+    def check_sources(self, sources, pkgs, pkg2range):
+        """Every package must be found at one of the sources"""
+        for nav in pkgs:
+            for _, ts, suite, comps in sources:
+                if (nav, suite) not in pkg2range:
+                    continue
+                c, b, e = pkg2range[nav, suite]
+                if b <= ts <= e and c in comps.split():
+                    break
+            else:
+                self.fail("%s:%s=%s is not covered" % nav)
+
+    def test_jobs(self):
+        argv = ["debootsnap", "--packages", "pkg1:amd64=1.0-1"]
+        with unittest.mock.patch.object(sys, "argv", argv + ["-j", "2"]):
+            self.assertEqual(debootsnap.parse_args().jobs, 2)
+        with unittest.mock.patch.object(
+            sys, "argv", argv + ["-j", "0"]
+        ), contextlib.redirect_stderr(io.StringIO()) as stderr:
+            with self.assertRaises(SystemExit):
+                debootsnap.parse_args()
+        self.assertIn("--jobs must be at least 1", stderr.getvalue())
+
+    def test_read_package_lists(self):
+        pkg1 = ("pkg1", "amd64", "1.0-1")
+        pkg2 = ("pkg2", "amd64", "2.0-1")
+        pkg3 = ("pkg3", "amd64", "1:3.0-1")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            packages = os.path.join(tmpdir, "Packages")
+            with open(packages, "w", encoding="utf8") as f:
+                f.write(
+                    "Package: pkg1\nArchitecture: amd64\nVersion: 1.0-1\n"
+                    "Filename: pool/main/p/pkg1/pkg1_1.0-1_amd64.deb\n"
+                    "Size: 10\nSHA256: %s\n\n"
+                    "Package: pkg2\nArchitecture: amd64\nVersion: 2.0-1\n"
+                    "Filename: pool/main/p/pkg2/pkg2_2.0-1_amd64.deb\n"
+                    "Size: 20\nMD5sum: %s\n" % ("0" * 64, "0" * 32)
+                )
+            with unittest.mock.patch.object(
+                debootsnap.subprocess,
+                "check_output",
+                return_value="%s\thttp://localhost/\n" % packages,
+            ):
+                debs = debootsnap.read_package_lists(tmpdir)
+        self.assertEqual(
+            debs[pkg1],
+            ("http://localhost/pool/main/p/pkg1/pkg1_1.0-1_amd64.deb", "0" * 64, 10),
+        )
+        self.assertIsNone(debs[pkg2][1])
+        # packages without a checksum are left to apt-get download just like
+        # packages which are not found
+        todo, remaining = debootsnap.resolve_debs(debs, [pkg1, pkg2, pkg3], "/cache")
+        self.assertEqual(
+            todo,
+            {
+                "http://localhost/pool/main/p/pkg1/pkg1_1.0-1_amd64.deb": (
+                    "0" * 64,
+                    10,
+                    "/cache/pkg1_1.0-1_amd64.deb",
+                )
+            },
+        )
+        self.assertEqual(remaining, [pkg2, pkg3])
+
+    def test_comp_ts(self):
+        ranges = [
+            ("main", "20200101T000000Z", "20200301T000000Z"),
+            ("contrib", "20200201T000000Z", "20200401T000000Z"),
+            ("main", "20200501T000000Z", "20200601T000000Z"),
+        ]
+        self.assertEqual(
+            debootsnap.comp_ts(ranges),
+            [
+                ("20200301T000000Z", {"main", "contrib"}),
+                ("20200601T000000Z", {"main"}),
+            ],
+        )
+        # a known timestamp that is in the same ranges is preferred
+        self.assertEqual(
+            debootsnap.comp_ts(ranges, {"20200215T000000Z", "20200520T000000Z"}),
+            [
+                ("20200215T000000Z", {"main", "contrib"}),
+                ("20200520T000000Z", {"main"}),
+            ],
+        )
+        # but not if it would need more timestamps
+        self.assertEqual(
+            debootsnap.comp_ts(ranges, {"20200115T000000Z"}),
+            [
+                ("20200301T000000Z", {"main", "contrib"}),
+                ("20200601T000000Z", {"main"}),
+            ],
+        )
+
+    def test_select_sources(self):
+        pkgs, text = synthetic_metasnap(300, 8)
+        suite2pkgs, pkg2range = debootsnap.parse_metasnap(text, pkgs)
+        sources = debootsnap.select_sources("debian", suite2pkgs, pkg2range)
+        self.check_sources(sources, pkgs, pkg2range)
+        # the suites are picked in the same order as by sorting all suites by
+        # the number of packages they still cover in every round
+        left = {suite: set(navs) for suite, navs in suite2pkgs.items()}
+        expected = []
+        while left:
+            best = sorted(left.items(), key=lambda v: len(v[1]))[-1][0]
+            expected.append(best)
+            for suite in left:
+                if suite != best:
+                    left[suite] -= left[best]
+            del left[best]
+            left = {suite: navs for suite, navs in left.items() if navs}
+        picked = []
+        for _, _, suite, _ in sources:
+            if suite not in picked:
+                picked.append(suite)
+        self.assertEqual(picked, expected)
+
+    def test_benchmark_select_sources(self):
+        pkgs, text = synthetic_metasnap(5000, 40)
+        started = time.perf_counter()
+        suite2pkgs, pkg2range = debootsnap.parse_metasnap(text, pkgs)
+        parsed = time.perf_counter()
+        sources = debootsnap.select_sources("debian", suite2pkgs, pkg2range)
+        finished = time.perf_counter()
+        self.check_sources(sources, pkgs, pkg2range)
+        if unittest_verbosity() >= 2:
+            sys.stderr.write(
+                "%d packages: parse %.3f s, select %.3f s, %d sources with "
+                "%d timestamps\n"
+                % (
+                    len(pkgs),
+                    parsed - started,
+                    finished - parsed,
+                    len(sources),
+                    len({ts for _, ts, _, _ in sources}),
+                )
+            )
+
+    def test_compute_sources_cache(self):
+        pkg1 = ("pkg1", "amd64", "1.0-1")
+        pkg2 = ("pkg2", "all", "2.0-1")
+        pkg3 = ("pkg3", "amd64", "3.0-1")
+        pkg4 = ("pkg4", "amd64", "4.0-1")
+        missing = ("missing", "amd64", "1")
+
+        def line(nav, suite, b, e):
+            return " ".join(nav + (suite, "main", b, e)) + "\n"
+
+        httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MetasnapHandler)
+        httpd.known = {
+            "debian": {
+                pkg1: line(pkg1, "sid", "20200101T000000Z", "20200301T000000Z"),
+                pkg2: line(pkg2, "sid", "20200201T000000Z", "20200401T000000Z"),
+                pkg4: line(pkg4, "sid", "20200101T000000Z", "20200401T000000Z"),
+            },
+            "debian-security": {
+                pkg3: line(pkg3, "bullseye-security", "20210101T000000Z", "20210102T000000Z"),
+            },
+        }
+        httpd.queried = []
+        server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        server_thread.start()
+        self.addCleanup(server_thread.join)
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        url = "http://127.0.0.1:%d/cgi-bin/api" % httpd.server_address[1]
+        with tempfile.TemporaryDirectory() as tmpdir, unittest.mock.patch.object(
+            debootsnap, "METASNAP_URL", url
+        ), unittest.mock.patch.dict(os.environ, {"no_proxy": "127.0.0.1"}):
+            cache = debootsnap.MetasnapCache(os.path.join(tmpdir, "metasnap.sqlite"))
+
+            def compute(pkgs):
+                with contextlib.redirect_stderr(io.StringIO()):
+                    return debootsnap.compute_sources(pkgs, "amd64", True, cache)
+
+            expected = [
+                ("debian", "20200301T000000Z", "sid", "main"),
+                ("debian-security", "20210102T000000Z", "bullseye-security", "main"),
+            ]
+            self.assertEqual(compute([pkg1, pkg2, pkg3, missing]), expected)
+
+            # every archive is only asked for what the ones before lacked
+            def archives(nav):
+                return sorted({a for a, navs in httpd.queried if nav in navs})
+
+            self.assertEqual(archives(pkg1), ["debian"])
+            self.assertEqual(archives(pkg3), sorted(debootsnap.ARCHIVES[:3]))
+            self.assertEqual(archives(missing), sorted(debootsnap.ARCHIVES))
+            # a second run is answered from the cache
+            httpd.queried.clear()
+            self.assertEqual(compute([pkg1, pkg2, pkg3, missing]), expected)
+            self.assertEqual(httpd.queried, [])
+            # an overlapping run only asks for the new package
+            self.assertEqual(
+                compute([pkg1, pkg4]),
+                [("debian", "20200301T000000Z", "sid", "main")],
+            )
+            self.assertEqual([navs for _, navs in httpd.queried], [{pkg4}])
+
+    def test_chroot_cache(self):
+        builds = []
+
+        def build(path):
+            builds.append(path)
+            time.sleep(0.2)
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.redirect_stderr(
+            io.StringIO()
+        ):
+            chroots = debootsnap.ChrootCache(tmpdir, 250)
+            keys = [
+                debootsnap.ChrootCache.key([("pkg", "amd64", str(i))], [], ".tar")
+                for i in range(3)
+            ]
+
+            def get(key):
+                with chroots.get(key, ".tar", build) as path:
+                    with open(path, "rb") as f:
+                        self.assertEqual(f.read(), b"x" * 100)
+
+            # concurrent invocations build the same chroot only once
+            threads = [threading.Thread(target=get, args=(keys[0],)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(builds), 1)
+            get(keys[1])
+            os.utime(os.path.join(tmpdir, keys[0] + ".tar"), (0, 0))
+            os.utime(os.path.join(tmpdir, keys[1] + ".tar"), (1, 1))
+            # the least recently used chroot is removed unless it is in use
+            with chroots.get(keys[0], ".tar", build):
+                os.utime(os.path.join(tmpdir, keys[0] + ".tar"), (0, 0))
+                get(keys[2])
+                chroots.evict()
+            self.assertEqual(len(builds), 3)
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, keys[0] + ".tar")))
+            self.assertFalse(os.path.exists(os.path.join(tmpdir, keys[1] + ".tar")))
+            self.assertTrue(os.path.exists(os.path.join(tmpdir, keys[2] + ".tar")))
+
+    def test_chroot_cache_leftovers(self):
+        def build(path):
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+
+        def failing_build(path):
+            build(path)
+            raise RuntimeError("mmdebstrap failed")
+
+        with tempfile.TemporaryDirectory() as tmpdir, contextlib.redirect_stderr(
+            io.StringIO()
+        ):
+            chroots = debootsnap.ChrootCache(tmpdir, 150)
+            keys = [
+                debootsnap.ChrootCache.key([("pkg", "amd64", str(i))], [], ".tar")
+                for i in range(4)
+            ]
+            # a failed build leaves no partial chroot behind
+            with self.assertRaises(RuntimeError):
+                with chroots.get(keys[0], ".tar", failing_build):
+                    pass
+            self.assertEqual(sorted(os.listdir(tmpdir)), [keys[0] + ".lock"])
+            # the remains of a killed build, a build in progress, a chroot
+            # that will be evicted and a file that is not ours
+            build(os.path.join(tmpdir, keys[1] + ".tmp.tar"))
+            build(os.path.join(tmpdir, keys[2] + ".tmp.tar"))
+            with chroots.get(keys[3], ".tar", build):
+                pass
+            os.utime(os.path.join(tmpdir, keys[3] + ".tar"), (0, 0))
+            with open(os.path.join(tmpdir, "README"), "w", encoding="utf8"):
+                pass
+            with open(os.path.join(tmpdir, keys[2] + ".lock"), "wb") as lock:
+                debootsnap.fcntl.flock(lock, debootsnap.fcntl.LOCK_EX)
+                with chroots.get(keys[0], ".tar", build):
+                    pass
+                chroots.evict()
+            self.assertEqual(
+                sorted(os.listdir(tmpdir)),
+                sorted(["README", keys[0] + ".lock", keys[0] + ".tar",
+                        keys[2] + ".lock", keys[2] + ".tmp.tar"]),
+            )
+            # an evicted chroot can be built again
+            with chroots.get(keys[3], ".tar", build) as path:
+                self.assertTrue(os.path.exists(path))
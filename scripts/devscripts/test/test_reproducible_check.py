@@ -0,0 +1,358 @@
+# test_reproducible_check.py - Test reproducible-check.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_reproducible_check.py - Test the parser, the index and the cache
+updates of reproducible-check"""
+
+import argparse
+import bz2
+import contextlib
+import http.server
+import io
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import tracemalloc
+import unittest
+import unittest.mock
+
+from . import load_script
+
+try:
+    with contextlib.redirect_stderr(io.StringIO()):
+        reproducible_check = load_script("reproducible-check")
+except SystemExit:
+    # python3-xdg is missing
+    reproducible_check = None
+
+RESULTS = [
+    {"package": "foo", "architecture": "amd64", "version": "1.0-1", "status": "reproducible"},
+    {"package": "foo", "architecture": "arm64", "version": "1.0-1", "status": "FTBR"},
+    {"package": "bar", "architecture": "amd64", "version": "2.0", "status": "reproducible"},
+    {"package": "bar", "architecture": "amd64", "version": "2.0", "status": "reproducible"},
+]
+
+
+def compress(results):
+    return bz2.compress(json.dumps(results, indent=1).encode())
+
+
+@unittest.skipIf(reproducible_check is None, "python3-xdg is not installed")
+class IterJsonArrayTestCase(unittest.TestCase):
+    def parse(self, text, chunk_size):
+        return list(reproducible_check.iter_json_array(io.BytesIO(text.encode()), chunk_size))
+
+    def test_chunks(self):
+        values = [12345, 678, -1.5e3, "aä\\\",c", {"a": [1, 2]}, [], True, None]
+        text = json.dumps(values, ensure_ascii=False)
+        for chunk_size in range(1, len(text.encode()) + 2):
+            self.assertEqual(self.parse(text, chunk_size), values, chunk_size)
+        self.assertEqual(self.parse(" [ ] ", 1), [])
+
+    def test_invalid(self):
+        for text in ["[1, 2", "[1, 2,", "[1, 2x]", "[1 2]", '[{"a": 1]', "{}", ""]:
+            for chunk_size in (1, 2, 1024):
+                with self.assertRaises(ValueError, msg=(text, chunk_size)):
+                    self.parse(text, chunk_size)
+
+
+@unittest.skipIf(reproducible_check is None, "python3-xdg is not installed")
+class ReproducibleIndexTestCase(unittest.TestCase):
+    def test_build(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "reproducible.sqlite")
+            reproducible_check.ReproducibleIndex.build(
+                path, io.BytesIO(compress(RESULTS)), {"If-None-Match": '"1"'}
+            )
+            for in_memory in (False, True):
+                index = reproducible_check.ReproducibleIndex(path, in_memory)
+                self.assertEqual(len(index), 2)
+                self.assertIn(("foo", "amd64", "1.0-1"), index)
+                self.assertIn(("bar", "amd64", "2.0"), index)
+                self.assertNotIn(("foo", "arm64", "1.0-1"), index)
+                self.assertNotIn(("foo", "amd64", "1.0-2"), index)
+                self.assertEqual(index.validators(), {"If-None-Match": '"1"'})
+
+    def test_path(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ("a?mode=rwc", "b#c", "d%3F", "e f"):
+                path = os.path.join(tmpdir, name, "reproducible.sqlite")
+                os.mkdir(os.path.dirname(path))
+                reproducible_check.ReproducibleIndex.build(
+                    path, io.BytesIO(compress(RESULTS)), {}
+                )
+                self.assertEqual(len(reproducible_check.ReproducibleIndex(path)), 2)
+            self.assertEqual(sorted(os.listdir(tmpdir)), ["a?mode=rwc", "b#c", "d%3F", "e f"])
+            with self.assertRaises(sqlite3.OperationalError):
+                reproducible_check.ReproducibleIndex(os.path.join(tmpdir, "missing"))
+
+    def test_streaming(self):
+        # the JSON is parsed while it is read instead of being loaded whole
+        results = [
+            {"package": "pkg%d" % i, "architecture": "amd64", "version": "1.0-%d" % i,
+             "status": "reproducible" if i % 3 else "FTBFS", "build_date": "2023-01-01"}
+            for i in range(20000)
+        ]
+        data = compress(results)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "reproducible.sqlite")
+            tracemalloc.start()
+            try:
+                reproducible_check.ReproducibleIndex.build(path, io.BytesIO(data), {})
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(len(reproducible_check.ReproducibleIndex(path)), 13333)
+        self.assertLess(peak, len(json.dumps(results)) / 4)
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    """Serve the server's "content" with the server's "etag", or answer
+    conditional requests for it with 304"""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.content)))
+        self.send_header("ETag", self.server.etag)
+        self.send_header("Last-Modified", "Sun, 01 Jan 2023 00:00:00 GMT")
+        self.end_headers()
+        self.wfile.write(self.server.content)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+@unittest.skipIf(reproducible_check is None, "python3-xdg is not installed")
+class UpdateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler)
+        server.requests = []
+        server.content = compress(RESULTS)
+        server.etag = '"1"'
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        self.addCleanup(server_thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        patch = unittest.mock.patch.dict(os.environ, {"no_proxy": "127.0.0.1"})
+        patch.start()
+        self.addCleanup(patch.stop)
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        # keep the logging configuration of the test runner
+        with unittest.mock.patch.object(logging, "basicConfig"):
+            self.check = reproducible_check.ReproducibleCheck(
+                argparse.Namespace(debug=False, trace=None)
+            )
+        self.check.STATUS_URL = "http://127.0.0.1:%d/reproducible.json.bz2" % (
+            server.server_address[1]
+        )
+        self.check.CACHE = os.path.join(tmpdir.name, "cache", "reproducible.sqlite")
+        self.check.OLD_CACHE = os.path.join(tmpdir.name, "cache", "reproducible.json.bz2")
+
+    def update_cache(self):
+        with self.assertLogs(level="DEBUG"):
+            self.check.update_cache()
+        return self.check.get_reproducible_packages()
+
+    def test_update_cache(self):
+        os.makedirs(os.path.dirname(self.check.OLD_CACHE))
+        with open(self.check.OLD_CACHE, "wb"):
+            pass
+        self.assertEqual(len(self.update_cache()), 2)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertNotIn("If-None-Match", self.server.requests[0])
+        self.assertFalse(os.path.exists(self.check.OLD_CACHE))
+        # a recent cache is used without asking the server
+        self.update_cache()
+        self.assertEqual(len(self.server.requests), 1)
+        # an old one is revalidated, and kept if it is unchanged
+        os.utime(self.check.CACHE, (0, 0))
+        self.assertEqual(len(self.update_cache()), 2)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]["If-None-Match"], '"1"')
+        self.assertEqual(
+            self.server.requests[1]["If-Modified-Since"], "Sun, 01 Jan 2023 00:00:00 GMT"
+        )
+        self.assertGreater(os.path.getmtime(self.check.CACHE), 0)
+        # or replaced if it changed, after the index that the validators were
+        # read from was closed
+        self.server.content = compress(RESULTS[:1])
+        self.server.etag = '"2"'
+        os.utime(self.check.CACHE, (0, 0))
+        index_class = reproducible_check.ReproducibleIndex
+        original_close, original_build = index_class.close, index_class.build
+        closed = []
+
+        def close(index):
+            closed.append(index)
+            original_close(index)
+
+        def build(*args):
+            self.assertEqual(len(closed), 1)
+            original_build(*args)
+
+        with unittest.mock.patch.object(
+            index_class, "close", close
+        ), unittest.mock.patch.object(index_class, "build", staticmethod(build)):
+            index = self.update_cache()
+        self.assertEqual(len(closed), 1)
+        self.assertEqual(len(index), 1)
+        self.assertEqual(index.validators()["If-None-Match"], '"2"')
+        self.assertEqual(len(self.server.requests), 3)
+
+
+DPKG_STATUS = """\
+Package: foo
+Status: install ok installed
+Architecture: amd64
+Version: 1.0-1+b2
+
+Package: libfoo1
+Status: install ok installed
+Architecture: i386
+Source: foo
+Version: 1.0-1+b2
+
+Package: foo-data
+Status: install ok installed
+Architecture: all
+Source: foo (1.0-1)
+Version: 1:1.0-1
+Description: data
+ Status: install ok installed
+
+Package: removed
+Status: deinstall ok config-files
+Architecture: amd64
+Version: 1.0
+"""
+
+
+@unittest.skipIf(reproducible_check is None, "python3-xdg is not installed")
+class PackageListTestCase(unittest.TestCase):
+    def test_read_dpkg_status(self):
+        self.assertEqual(
+            reproducible_check.read_dpkg_status(io.StringIO(DPKG_STATUS)),
+            {
+                ("foo", "amd64", "1.0-1"): "foo",
+                ("libfoo1", "i386", "1.0-1"): "foo",
+                ("foo-data", "all", "1.0-1"): "foo",
+            },
+        )
+
+    def test_read_package_list(self):
+        packages = io.StringIO(
+            "foo\t1.0-1+b2\tfoo\tarm64\n"
+            "libfoo1:i386\t1.0-1\tfoo\ti386\n"
+            "foo-data\t1:1.0-1\tfoo\tall\n"
+            "broken\n"
+        )
+        self.assertEqual(
+            reproducible_check.read_package_list(packages, "amd64"),
+            {
+                ("foo", "arm64", "1.0-1"): "foo",
+                ("libfoo1", "i386", "1.0-1"): "foo",
+                ("foo-data", "all", "1:1.0-1"): "foo",
+            },
+        )
+
+    def test_read_package_list_without_architecture(self):
+        # only foreign and Multi-Arch: same packages have their architecture in
+        # ${binary:Package}, the others get the most common one
+        packages = io.StringIO(
+            "foo\t1.0-1\tfoo\nlibfoo1:i386\t1.0-1\tfoo\n"
+            "libfoo1:arm64\t1.0-1\tfoo\nlibc6:arm64\t2.36-9\tglibc\n"
+        )
+        with self.assertLogs(level="WARNING") as logs:
+            result = reproducible_check.read_package_list(packages, "amd64")
+        self.assertEqual(
+            result,
+            {
+                ("foo", "arm64", "1.0-1"): "foo",
+                ("libfoo1", "i386", "1.0-1"): "foo",
+                ("libfoo1", "arm64", "1.0-1"): "foo",
+                ("libc6", "arm64", "2.36-9"): "glibc",
+            },
+        )
+        self.assertIn("no ${Architecture} field for 1 packages, assuming arm64",
+                      logs.output[0])
+        # without any hint, the architecture of this machine is used
+        with self.assertLogs(level="WARNING"):
+            result = reproducible_check.read_package_list(io.StringIO("foo\t1\tfoo\n"), "amd64")
+        self.assertEqual(result, {("foo", "amd64", "1"): "foo"})
+
+    def test_guess_architecture(self):
+        installed = {
+            ("foo", "arm64", "1"): "foo",
+            ("bar", "arm64", "1"): "bar",
+            ("libbar1", "armhf", "1"): "bar",
+            ("foo-data", "all", "1"): "foo",
+            ("bar-data", "all", "1"): "bar",
+            ("baz-data", "all", "1"): "baz",
+        }
+        self.assertEqual(reproducible_check.guess_architecture(installed, "amd64"), "arm64")
+        self.assertEqual(reproducible_check.guess_architecture({}, "amd64"), "amd64")
+
+
+@unittest.skipIf(reproducible_check is None, "python3-xdg is not installed")
+class HostsTestCase(unittest.TestCase):
+    def test_architecture(self):
+        # foo-data is reproducible on arm64 only, and this machine is amd64
+        reproducible = {("foo", "arm64", "1.0-1"), ("bar", "amd64", "2.0")}
+        hosts = {
+            "arm64-host": "foo\t1.0-1\tfoo\tarm64\nfoo-data\t1.0-1\tfoo\tall\n",
+            "amd64-host": "bar\t2.0\tbar\tamd64\nfoo-data\t1.0-1\tfoo\tall\n",
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, "hosts"))
+            for host, packages in hosts.items():
+                with open(os.path.join(tmpdir, "hosts", host), "w", encoding="utf8") as f:
+                    f.write(packages)
+            with unittest.mock.patch.object(logging, "basicConfig"):
+                check = reproducible_check.ReproducibleCheck(
+                    argparse.Namespace(
+                        debug=False, trace=None, hosts=[os.path.join(tmpdir, "hosts")],
+                        raw=False,
+                        report_dir=os.path.join(tmpdir, "reports"),
+                    )
+                )
+            check.default_architecture = "amd64"
+            self.assertEqual(
+                [(host, native) for host, _, native in check.iter_hosts()],
+                [("amd64-host", "amd64"), ("arm64-host", "arm64")],
+            )
+            with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                check.output_hosts(reproducible)
+            with open(os.path.join(tmpdir, "reports", "arm64-host"), encoding="utf8") as f:
+                self.assertNotIn("foo", f.read())
+            with open(os.path.join(tmpdir, "reports", "amd64-host"), encoding="utf8") as f:
+                self.assertIn("foo", f.read())
+        self.assertEqual(
+            stdout.getvalue().splitlines(),
+            [
+                "foo (1.0-1) is not reproducible on 1 hosts "
+                "<https://tests.reproducible-builds.org/debian/foo>",
+                "3/4 (75.00%) of installed binary packages on 2 hosts are reproducible.",
+            ],
+        )
@@ -0,0 +1,138 @@
+# test_sadt.py - Test the build tree copy of sadt.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_sadt.py - Test and benchmark the rw-build-tree copy strategies"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from . import load_script, unittest_verbosity
+
+sadt = load_script("sadt")
+
+
+def make_tree(path, numdirs, numfiles):
+    """Fill path with numdirs directories of numfiles small files each"""
+    for i in range(numdirs):
+        directory = os.path.join(path, "dir%d" % i)
+        os.mkdir(directory)
+        for j in range(numfiles):
+            with open(os.path.join(directory, "file%d" % j), "w", encoding="utf8") as f:
+                f.write("content of file %d in directory %d\n" % (j, i))
+
+
+def read_tree(path):
+    """Return a dict mapping the relative path of every file to its content"""
+    contents = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            filename = os.path.join(dirpath, filename)
+            if os.path.islink(filename):
+                contents[os.path.relpath(filename, path)] = "-> " + os.readlink(filename)
+                continue
+            with open(filename, encoding="utf8") as f:
+                contents[os.path.relpath(filename, path)] = f.read()
+    return contents
+
+
+class BuildTreeCopyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        self.tree = os.path.join(self.tmpdir.name, "tree")
+        os.mkdir(self.tree)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tree)
+
+    def copy(self, strategy):
+        try:
+            build_tree_copy = sadt.BuildTreeCopy(strategy)
+        except (OSError, subprocess.CalledProcessError) as exc:
+            if strategy in ("reflink", "overlay"):
+                self.skipTest("%s is not supported here: %s" % (strategy, exc))
+            raise
+        self.addCleanup(build_tree_copy.cleanup)
+        self.assertEqual(build_tree_copy.strategy, strategy)
+        return build_tree_copy
+
+    def test_strategies(self):
+        make_tree(self.tree, 2, 3)
+        os.symlink("dir0/file0", "link")
+        expected = read_tree(self.tree)
+        for strategy in sadt.BuildTreeCopy.strategies:
+            with self.subTest(strategy=strategy):
+                build_tree_copy = self.copy(strategy)
+                self.assertEqual(read_tree(build_tree_copy.path), expected)
+                # the usual ways for a build to change the tree
+                with open(os.path.join(build_tree_copy.path, "new"), "w",
+                          encoding="utf8") as f:
+                    f.write("new file\n")
+                replacement = os.path.join(build_tree_copy.path, "dir0", "file1.new")
+                with open(replacement, "w", encoding="utf8") as f:
+                    f.write("replaced\n")
+                os.replace(replacement, os.path.join(build_tree_copy.path, "dir0", "file1"))
+                os.unlink(os.path.join(build_tree_copy.path, "dir1", "file2"))
+                self.assertEqual(read_tree(self.tree), expected)
+                build_tree_copy.cleanup()
+                self.assertFalse(os.path.exists(build_tree_copy.tmpdir))
+
+    def test_auto(self):
+        make_tree(self.tree, 1, 1)
+        build_tree_copy = sadt.BuildTreeCopy()
+        self.addCleanup(build_tree_copy.cleanup)
+        self.assertIn(build_tree_copy.strategy, sadt.BuildTreeCopy.auto_strategies)
+        self.assertEqual(read_tree(build_tree_copy.path), read_tree(self.tree))
+
+    def test_break_link(self):
+        make_tree(self.tree, 1, 1)
+        build_tree_copy = self.copy("hardlink")
+        path = os.path.join(build_tree_copy.path, "dir0", "file0")
+        sadt.break_link(path)
+        sadt.chmod_x(path)
+        with open(path, "a", encoding="utf8") as f:
+            f.write("appended\n")
+        with open(os.path.join(self.tree, "dir0", "file0"), encoding="utf8") as f:
+            self.assertEqual(f.read(), "content of file 0 in directory 0\n")
+        self.assertFalse(os.access(os.path.join(self.tree, "dir0", "file0"), os.X_OK))
+
+    def test_benchmark(self):
+        # copying 100000 files with cp -a takes long enough to only do it
+        # when the timings are shown
+        numdirs = 1000 if unittest_verbosity() >= 2 else 100
+        make_tree(self.tree, numdirs, 100)
+        timings = []
+        copy_elapsed = None
+        # cp -a first, as the reference for the others
+        for strategy in ("copy", "reflink", "overlay", "hardlink"):
+            try:
+                build_tree_copy = sadt.BuildTreeCopy(strategy)
+            except (OSError, subprocess.CalledProcessError):
+                timings.append("%s unsupported" % strategy)
+                continue
+            started = time.perf_counter()
+            build_tree_copy.cleanup()
+            timings.append(
+                "%s %.2f s (cleanup %.2f s)"
+                % (strategy, build_tree_copy.elapsed, time.perf_counter() - started)
+            )
+            if copy_elapsed is None:
+                copy_elapsed = build_tree_copy.elapsed
+            else:
+                self.assertLess(build_tree_copy.elapsed, copy_elapsed * 2 + 1)
+        if unittest_verbosity() >= 2:
+            sys.stderr.write("%d files: %s\n" % (numdirs * 100, ", ".join(timings)))
@@ -0,0 +1,142 @@
+# test_startup.py - Benchmark the startup of the Python scripts.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_startup.py - Check that the scripts start without loading heavy modules"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from . import SCRIPTS, unittest_verbosity
+
+# modules which take tens of milliseconds to import, and are only needed
+# once a script does real work
+HEAVY_MODULES = (
+    "apt",
+    "dateutil",
+    "debian.deb822",
+    "magic",
+    "parsedatetime",
+    "pycurl",
+    "requests",
+)
+
+# trivial runs, besides --help: (arguments, files to create, expected exit code)
+TRIVIAL_RUNS = {
+    "sadt": ([], {}, 1),
+    "suspicious-source": (["-d", "."], {"hello.el": "(provide 'hello)\n"}, 0),
+    "wrap-and-sort": (["-n"], {"debian/control": "Source: hello\n"}, 0),
+}
+
+RUNS = 5
+
+# the time a script may take on top of starting the interpreter
+MAX_OVERHEAD = 0.25
+MAX_IMPORT_TIME = 0.15
+
+
+def load_tests(loader, tests, pattern):  # pylint: disable=unused-argument
+    "Give StartupTestCase a chance to populate before loading its test cases"
+    suite = unittest.TestSuite()
+    StartupTestCase.populate()
+    suite.addTests(loader.loadTestsFromTestCase(StartupTestCase))
+    return suite
+
+
+def run(args, cwd=None):
+    """Run the Python interpreter with args, return the exit code, the stderr
+    output, the modules imported and the wall-clock time"""
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable] + args, cwd=cwd, check=False,
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    with_importtime = subprocess.run([sys.executable, "-X", "importtime"] + args,
+                                     cwd=cwd, check=False, stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                     text=True)
+    return process.returncode, process.stderr, parse_importtime(with_importtime.stderr), elapsed
+
+
+def parse_importtime(output):
+    """Return a dict mapping the modules reported by -X importtime to their
+    cumulative import time in seconds, and whether they were imported by the
+    script itself rather than by another module"""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = (int(cumulative) / 1e6, not name[1:].startswith(" "))
+    return modules
+
+
+class StartupTestCase(unittest.TestCase):
+    baseline_elapsed = 0.0
+    baseline_modules = frozenset()
+
+    @classmethod
+    def populate(cls):
+        for script in SCRIPTS:
+            setattr(cls, "test_" + script.replace("-", "_"), cls.make_startup_tester(script))
+
+    @classmethod
+    def setUpClass(cls):
+        samples = [run(["-c", "pass"]) for _ in range(RUNS)]
+        cls.baseline_elapsed = min(sample[3] for sample in samples)
+        cls.baseline_modules = frozenset(samples[0][2])
+
+    def measure(self, script, args, cwd=None, expected=0):
+        """Run script with args RUNS times, and check that it loads no heavy
+        modules and that its fastest run and its imports are fast enough"""
+        path = os.path.abspath(script)
+        if not os.path.exists(path):  # pragma: no cover
+            path = os.path.join(os.environ.get("OLDPWD", ""), script)
+        samples = [run([path] + args, cwd) for _ in range(RUNS)]
+        returncode, stderr, modules, _ = samples[0]
+        if returncode != expected and any(
+                message in stderr for message in ("ImportError", "ModuleNotFoundError",
+                                                  "install")):
+            self.skipTest("%s cannot be imported here: %s"
+                          % (script, stderr.strip().splitlines()[-1]))
+        self.assertEqual(returncode, expected, stderr)
+        heavy = [name for name in HEAVY_MODULES if name in modules]
+        self.assertEqual(heavy, [], "%s %s imports heavy modules" % (script, " ".join(args)))
+        import_time = sum(cumulative for name, (cumulative, toplevel) in modules.items()
+                          if toplevel and name not in self.baseline_modules)
+        overhead = min(sample[3] for sample in samples) - self.baseline_elapsed
+        if unittest_verbosity() >= 2:
+            sys.stderr.write("%s %s: %.0f ms (imports %.0f ms) ... "
+                             % (script, " ".join(args), overhead * 1000, import_time * 1000))
+        self.assertLess(import_time, MAX_IMPORT_TIME)
+        self.assertLess(overhead, MAX_OVERHEAD)
+
+    @classmethod
+    def make_startup_tester(cls, script):
+        def tester(self):
+            self.measure(script, ["--help"])
+            if script not in TRIVIAL_RUNS:
+                return
+            args, files, expected = TRIVIAL_RUNS[script]
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for name, content in files.items():
+                    filename = os.path.join(tmpdir, name)
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    with open(filename, "w", encoding="utf8") as f:
+                        f.write(content)
+                self.measure(script, args, tmpdir, expected)
+        return tester
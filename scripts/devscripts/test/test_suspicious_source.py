@@ -0,0 +1,91 @@
+# test_suspicious_source.py - Test the scanner of suspicious-source.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_suspicious_source.py - Test the pre-filter and the cache of suspicious-source"""
+
+import os
+import random
+import tempfile
+import unittest
+import unittest.mock
+
+from . import load_script
+
+suspicious_source = load_script("suspicious-source")
+
+
+class SuspiciousSourceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        self.tree = os.path.join(self.tmpdir.name, "tree")
+        for name, content in (
+            ("main.c", "int main(void) { return 0; }\n"),
+            ("blob.bin", b"\x7fELF\x02\x01\x01" + bytes(range(256)) * 4),
+            ("font.sfd", b"\x00\x01\x02"),
+            (".git/objects", b"\x00\x01\x02"),
+            ("sub/data.dat", b"\x89\x00\xff" * 100),
+            ("sub/README", "hello\n"),
+        ):
+            path = os.path.join(self.tree, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            mode = "wb" if isinstance(content, bytes) else "w"
+            with open(path, mode) as f:  # pylint: disable=unspecified-encoding
+                f.write(content)
+
+    def scan(self, jobs=1, cache=None):
+        return list(suspicious_source.suspicious_source(
+            suspicious_source.DEFAULT_WHITELISTED_MIMETYPES,
+            suspicious_source.DEFAULT_WHITELISTED_EXTENSIONS,
+            self.tree, jobs, cache))
+
+    def test_has_extension(self):
+        rng = random.Random(0)
+        extensions = [".sfd", ".el", ".tar.gz", "z", ""]
+        for i in range(len(extensions)):
+            lengths = sorted({len(x) for x in extensions[i:]})
+            for _ in range(200):
+                name = "".join(rng.choice("ab.sfdeltrgz") for _ in range(rng.randrange(8)))
+                self.assertEqual(
+                    suspicious_source.has_extension(name, set(extensions[i:]), lengths),
+                    any(name.endswith(x) for x in extensions[i:]),
+                    name)
+
+    def test_scan(self):
+        suspicious = self.scan()
+        self.assertEqual([os.path.relpath(path, self.tree) for path, _ in suspicious],
+                         ["blob.bin", "sub/data.dat"])
+        self.assertEqual(self.scan(jobs=4), suspicious)
+
+    def test_cache(self):
+        cache_file = os.path.join(self.tmpdir.name, "cache.sqlite")
+        magic_file = suspicious_source.magic_file
+        with unittest.mock.patch.object(suspicious_source, "magic_file",
+                                        side_effect=magic_file) as mock:
+            suspicious = self.scan(cache=suspicious_source.MimetypeCache(cache_file))
+            # font.sfd is cleared by its extension, .git is not scanned
+            self.assertEqual(mock.call_count, 4)
+
+            mock.reset_mock()
+            self.assertEqual(self.scan(cache=suspicious_source.MimetypeCache(cache_file)),
+                             suspicious)
+            self.assertEqual(mock.call_count, 0)
+
+            mock.reset_mock()
+            with open(os.path.join(self.tree, "sub", "README"), "wb") as f:
+                f.write(bytes(range(256)) * 4)
+            self.assertEqual(
+                len(self.scan(cache=suspicious_source.MimetypeCache(cache_file))), 3)
+            self.assertEqual([call.args for call in mock.call_args_list],
+                             [(os.path.join(self.tree, "sub", "README"),)])
@@ -0,0 +1,99 @@
+# test_trace.py - Test devscripts.trace.Trace.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_trace.py - Test the trace files and the cost of disabled tracing"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+from devscripts.trace import Trace
+
+from . import unittest_verbosity
+
+
+class TraceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(Trace.close)
+
+    def trace(self, filename):
+        filename = os.path.join(self.tmpdir.name, filename)
+        Trace.enable(filename)
+        with Trace.span("outer", answer=42):
+            with Trace.span("inner"):
+                Trace.count("bytes", 100)
+                Trace.count("bytes", 23)
+            with Trace.process("python"):
+                subprocess.run([sys.executable, "-c", "sum(range(10 ** 6))"], check=True)
+        return filename
+
+    def check_events(self, events):
+        self.assertEqual(events[0]["ph"], "M")
+        spans = {event["name"]: event for event in events if event["ph"] == "X"}
+        self.assertEqual(list(spans), ["inner", "python", "outer"])
+        outer = spans["outer"]
+        self.assertEqual(outer["args"], {"answer": 42})
+        for name in ("inner", "python"):
+            self.assertGreaterEqual(spans[name]["ts"], outer["ts"])
+            self.assertLessEqual(spans[name]["ts"] + spans[name]["dur"],
+                                 outer["ts"] + outer["dur"])
+        self.assertEqual(spans["python"]["cat"], "process")
+        self.assertGreater(spans["python"]["args"]["user"] + spans["python"]["args"]["system"],
+                           0)
+        counters = [event for event in events if event["ph"] == "C"]
+        self.assertEqual(counters[-1]["args"], {"value": 123})
+
+    def test_chrome(self):
+        filename = self.trace("trace.json")
+        Trace.close()
+        with open(filename, encoding="utf-8") as f:
+            self.check_events(json.load(f)["traceEvents"])
+
+    def test_json_lines(self):
+        filename = self.trace("trace.jsonl")
+        # the events are written as they happen
+        with open(filename, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 5)
+        Trace.close()
+        with open(filename, encoding="utf-8") as f:
+            self.check_events([json.loads(line) for line in f])
+
+    def test_add_argument(self):
+        parser = argparse.ArgumentParser()
+        with unittest.mock.patch.dict(os.environ, {"DEVSCRIPTS_TRACE": "env.json"}):
+            Trace.add_argument(parser)
+        self.assertEqual(parser.parse_args([]).trace, "env.json")
+        self.assertEqual(parser.parse_args(["--trace", "arg.json"]).trace, "arg.json")
+
+    def test_disabled(self):
+        self.assertFalse(Trace.enabled)
+        Trace.enable(None)
+        self.assertFalse(Trace.enabled)
+        iterations = 100000
+        started = time.perf_counter()
+        for _ in range(iterations):
+            with Trace.span("nothing", i=1):
+                Trace.count("nothing", 1)
+        elapsed = (time.perf_counter() - started) / iterations
+        if unittest_verbosity() >= 2:
+            sys.stderr.write("%.2f us per disabled span ... " % (elapsed * 1e6))
+        self.assertLess(elapsed, 5e-6)
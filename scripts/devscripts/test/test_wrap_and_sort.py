@@ -0,0 +1,249 @@
+# test_wrap_and_sort.py - Test wrap-and-sort.
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES WITH
+# REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY
+# AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT,
+# INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+# LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR
+# OTHER TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR
+# PERFORMANCE OF THIS SOFTWARE.
+
+"""test_wrap_and_sort.py - Test the cache of wrapped and sorted files and
+the processing of many debian directories"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+import debian.deb822
+
+from . import load_script
+
+wrap_and_sort = load_script("wrap-and-sort")
+
+# wrapped and sorted with the default options, but not with --wrap-always
+CONTROL = """\
+Source: foo
+Build-Depends: a, b
+
+Package: foo
+Architecture: any
+Depends: c
+"""
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as f:
+        f.write(content)
+
+
+def parse_args(*args):
+    with unittest.mock.patch.object(sys, "argv", ["wrap-and-sort"] + list(args)):
+        return wrap_and_sort.parse_args()
+
+
+class FormattedFilesTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "debian", "control")
+        write(self.path, CONTROL)
+        patch = unittest.mock.patch.object(
+            wrap_and_sort, "file_digest", side_effect=wrap_and_sort.file_digest
+        )
+        self.file_digest = patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_unchanged(self):
+        formatted = wrap_and_sort.FormattedFiles("options")
+        self.assertFalse(formatted.is_formatted(self.path))
+        formatted.add(self.path)
+        self.file_digest.reset_mock()
+        # the size and modification time are enough
+        self.assertTrue(formatted.is_formatted(self.path))
+        self.file_digest.assert_not_called()
+
+    def test_touched(self):
+        formatted = wrap_and_sort.FormattedFiles("options")
+        formatted.add(self.path)
+        os.utime(self.path, ns=(0, 0))
+        self.file_digest.reset_mock()
+        # the content is hashed when the modification time changed, and the
+        # new one is remembered
+        self.assertTrue(formatted.is_formatted(self.path))
+        self.file_digest.assert_called_once()
+        self.assertTrue(formatted.is_formatted(self.path))
+        self.file_digest.assert_called_once()
+
+    def test_changed(self):
+        formatted = wrap_and_sort.FormattedFiles("options")
+        formatted.add(self.path)
+        write(self.path, CONTROL.replace("a, b", "b, a"))
+        os.utime(self.path, ns=(0, 0))
+        self.assertFalse(formatted.is_formatted(self.path))
+        write(self.path, CONTROL + "Suggests: d\n")
+        self.file_digest.reset_mock()
+        # a different size is enough
+        self.assertFalse(formatted.is_formatted(self.path))
+        self.file_digest.assert_not_called()
+
+    def test_options(self):
+        formatted = wrap_and_sort.FormattedFiles("options")
+        formatted.add(self.path)
+        other = wrap_and_sort.FormattedFiles("other options", formatted.entries)
+        self.assertFalse(other.is_formatted(self.path))
+        self.assertNotEqual(
+            wrap_and_sort.get_cache_options(parse_args("-d", os.path.dirname(self.path))),
+            wrap_and_sort.get_cache_options(
+                parse_args("-a", "-d", os.path.dirname(self.path))
+            ),
+        )
+
+    def test_cache(self):
+        formatted = wrap_and_sort.FormattedFiles("options")
+        formatted.add(self.path)
+        cache = wrap_and_sort.FormattedFilesCache(
+            os.path.join(os.path.dirname(self.path), "cache.sqlite")
+        )
+        cache.store("/tree1", formatted.entries)
+        cache.store("/tree2", {"/tree2/debian/docs": (1, 2, "3", "options")})
+        cache.store("/tree2", {"/tree2/debian/dirs": (4, 5, "6", "options")})
+        self.assertEqual(
+            cache.load(),
+            {
+                "/tree1": formatted.entries,
+                "/tree2": {"/tree2/debian/dirs": (4, 5, "6", "options")},
+            },
+        )
+
+    def test_dry_run(self):
+        debian_directory = os.path.dirname(self.path)
+        write(os.path.join(debian_directory, "docs"), "README\n")
+        args = parse_args("-a", "-N", "-d", debian_directory)
+        formatted = wrap_and_sort.FormattedFiles(wrap_and_sort.get_cache_options(args))
+        files = wrap_and_sort.get_files(debian_directory)
+        self.assertEqual(wrap_and_sort.wrap_and_sort(args, files, formatted), [self.path])
+        # the file that would be modified is not wrapped and sorted yet
+        self.assertEqual(sorted(formatted.entries), [os.path.join(debian_directory, "docs")])
+        args.dry_run = False
+        self.assertEqual(wrap_and_sort.wrap_and_sort(args, files, formatted), [self.path])
+        self.assertEqual(sorted(formatted.entries), sorted(files))
+        self.assertEqual(wrap_and_sort.wrap_and_sort(args, files, formatted), [])
+
+
+class WrapAndSortControlTestCase(unittest.TestCase):
+    """Compare the results with those of the python-debian parser that
+    wrap-and-sort used before, for files without comments"""
+
+    SAMPLES = [
+        # formatting that python-debian normalizes
+        "Source: foo\nMaintainer:   Jane <j@e.org>\nStandards-Version:4.6.0\n"
+        "Section : devel\n",
+        "\n\nSource: foo\nBuild-Depends: b,a\n\n\nPackage: foo\n"
+        "Description:  foo\n long\n .\n text  \n\n",
+        "Source: foo\r\nBuild-Depends:\r\n a,\r\n b\r\n\r\nPackage: foo\r\n",
+        # already formatted
+        "Source: foo\nUploaders: B <b@e.org>, A <a@e.org>\n\nPackage: foo-bin\n"
+        "Architecture: any linux-any\nDepends: ${misc:Depends}, a | b\n\n"
+        "Package: foo-data\nArchitecture: all\nDepends: c\n",
+    ]
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.debian = os.path.join(tmpdir.name, "debian")
+        self.path = os.path.join(self.debian, "control")
+        os.mkdir(self.debian)
+
+    def deb822(self, args):
+        control = wrap_and_sort.WrapAndSortControl.__new__(wrap_and_sort.WrapAndSortControl)
+        control.filename = self.path
+        control.args = args
+        with open(self.path, encoding="utf8") as f:
+            control.paragraphs = list(debian.deb822.Deb822.iter_paragraphs(f))
+        control.separators = None
+        return control
+
+    def test_deb822(self):
+        for options in [[], ["-a"], ["-a", "-s", "-t"], ["-b", "-n"]]:
+            for sample in self.SAMPLES:
+                with open(self.path, "w", encoding="utf8", newline="") as f:
+                    f.write(sample)
+                args = parse_args("-d", self.debian, *options)
+                control = wrap_and_sort.WrapAndSortControl(self.path, args)
+                reference = self.deb822(args)
+                for x in (control, reference):
+                    if args.cleanup:
+                        x.strip_trailing_spaces()
+                    x.wrap_and_sort()
+                self.assertEqual(control.dump(), reference.dump(), (options, sample))
+                self.assertEqual(control.check_changed(), reference.dump() != sample)
+
+
+class ProcessTreesTestCase(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.cache = os.path.join(self.tmpdir, "cache.sqlite")
+        self.trees = [os.path.join(self.tmpdir, name, "debian") for name in "abc"]
+        for tree in self.trees:
+            write(os.path.join(tree, "control"), CONTROL)
+
+    def run_trees(self, *args):
+        script = os.path.abspath("wrap-and-sort")
+        if not os.path.exists(script):  # pragma: no cover
+            script = os.path.join(os.environ.get("OLDPWD", ""), "wrap-and-sort")
+        argv = [script, "--json", "-j", "2", "--cache", self.cache] + list(args)
+        for tree in self.trees:
+            argv.extend(["-d", tree])
+        process = subprocess.run(argv, stdout=subprocess.PIPE, check=False)
+        summary = json.loads(process.stdout)
+        return process.returncode, {
+            os.path.basename(os.path.dirname(tree["debian_directory"])): tree.get(
+                "modified_files", tree.get("error")
+            )
+            for tree in summary
+        }
+
+    def test_cache(self):
+        self.assertEqual(self.run_trees(), (0, {"a": [], "b": [], "c": []}))
+        # unchanged files are skipped, even if they are not wrapped and sorted
+        # any more, as long as their size and modification time did not change
+        control = os.path.join(self.trees[0], "control")
+        stat = os.stat(control)
+        write(control, CONTROL.replace("a, b", "b, a"))
+        os.utime(control, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(self.run_trees("-N"), (0, {"a": [], "b": [], "c": []}))
+        # other options invalidate the cache
+        self.assertEqual(
+            self.run_trees("-a", "-N"),
+            (0, {name: [os.path.join(tree, "control")]
+                 for name, tree in zip("abc", self.trees)}),
+        )
+        # which did not record the files that would be modified
+        self.assertEqual(
+            self.run_trees("-a"),
+            (0, {name: [os.path.join(tree, "control")]
+                 for name, tree in zip("abc", self.trees)}),
+        )
+        self.assertEqual(self.run_trees("-a"), (0, {"a": [], "b": [], "c": []}))
+
+    def test_error(self):
+        # one broken debian directory does not stop the others
+        with open(os.path.join(self.trees[1], "control"), "wb") as f:
+            f.write(b"Source: \xff\n")
+        returncode, summary = self.run_trees("-a")
+        self.assertEqual(returncode, 1)
+        self.assertEqual(summary["a"], [os.path.join(self.trees[0], "control")])
+        self.assertIn("codec", summary["b"])
+        self.assertEqual(summary["c"], [os.path.join(self.trees[2], "control")])
@@ -0,0 +1,179 @@
+#   trace.py - Timing instrumentation for the Python scripts
+#
+#   Permission to use, copy, modify, and/or distribute this software
+#   for any purpose with or without fee is hereby granted, provided
+#   that the above copyright notice and this permission notice appear
+#   in all copies.
+#
+#   THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL
+#   WARRANTIES WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED
+#   WARRANTIES OF MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE
+#   AUTHOR BE LIABLE FOR ANY SPECIAL, DIRECT, INDIRECT, OR
+#   CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM
+#   LOSS OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+#   NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+#   CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+"""Record where the time of a script goes
+
+Spans time a block of code, process spans additionally account the CPU
+time of the subprocesses waited for in the block, and counters add up
+quantities like the bytes downloaded. The events are written in the Trace
+Event Format, which chrome://tracing and https://ui.perfetto.dev display:
+as a JSON object when the file name ends in .json, and as one JSON object
+per line otherwise, which is written as the events happen. Only the process
+which enabled tracing is traced, not the worker processes forked from it.
+
+Tracing is enabled with the --trace option of the scripts or by setting
+DEVSCRIPTS_TRACE to a file name. When it is disabled, spans and counters
+return right away.
+"""
+
+import atexit
+import contextlib
+import os
+import resource
+import sys
+import threading
+import time
+
+ENVIRONMENT_VARIABLE = "DEVSCRIPTS_TRACE"
+
+# counters are written at most this often (in seconds), and at the end
+COUNTER_INTERVAL = 0.05
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def _now():
+    """Return the current time in microseconds, as the trace wants it"""
+    return time.perf_counter_ns() // 1000
+
+
+class Trace:
+    enabled = False
+
+    _file = None
+    _json = None
+    _chrome = False
+    _events = []
+    _counters = {}
+    _lock = threading.Lock()
+    _pid = None
+
+    @classmethod
+    def add_argument(cls, parser):
+        """Add the --trace option to an argparse parser"""
+        parser.add_argument(
+            "--trace", metavar="FILE",
+            default=os.environ.get(ENVIRONMENT_VARIABLE) or None,
+            help="write timing information to FILE, in Chrome trace format "
+            "if it ends in .json and as JSON lines otherwise "
+            "(default: $%s)" % ENVIRONMENT_VARIABLE)
+
+    @classmethod
+    def enable(cls, filename):
+        """Start tracing into filename, if it is set"""
+        if not filename or cls.enabled:
+            return
+        import json  # pylint: disable=import-outside-toplevel
+        cls._json = json
+        cls._chrome = filename.endswith(".json")
+        # pylint: disable=consider-using-with
+        cls._file = open(filename, "w", encoding="utf-8")
+        cls._events = []
+        cls._counters = {}
+        cls._pid = os.getpid()
+        cls.enabled = True
+        cls._emit({"name": "process_name", "ph": "M",
+                   "args": {"name": os.path.basename(sys.argv[0])}})
+        atexit.register(cls.close)
+
+    @classmethod
+    def close(cls):
+        """Write the outstanding counters and finish the trace file"""
+        if not cls.enabled or os.getpid() != cls._pid:
+            return
+        with cls._lock:
+            for name in cls._counters:
+                cls._emit_counter(name)
+            if cls._chrome:
+                cls._json.dump({"traceEvents": cls._events, "displayTimeUnit": "ms"},
+                               cls._file)
+            cls._file.close()
+            cls.enabled = False
+
+    @classmethod
+    def _emit(cls, event):
+        if os.getpid() != cls._pid:
+            # only the process which enabled tracing is traced, not the
+            # worker processes forked from it
+            return
+        event.setdefault("ts", _now())
+        event["pid"] = cls._pid
+        event["tid"] = threading.get_ident()
+        if cls._chrome:
+            cls._events.append(event)
+        else:
+            cls._file.write(cls._json.dumps(event) + "\n")
+            cls._file.flush()
+
+    @classmethod
+    def span(cls, name, /, **args):
+        """Return a context manager timing the block it is used for"""
+        if not cls.enabled:
+            return _NULL_SPAN
+        return cls._span(name, "span", args)
+
+    @classmethod
+    def process(cls, name, /, **args):
+        """Like span(), but also record the CPU time of the subprocesses
+        waited for in the block.
+
+        The CPU time comes from getrusage(RUSAGE_CHILDREN), so it includes
+        the subprocesses that other threads wait for at the same time.
+        """
+        if not cls.enabled:
+            return _NULL_SPAN
+        return cls._span(name, "process", args)
+
+    @classmethod
+    @contextlib.contextmanager
+    def _span(cls, name, category, args):
+        if category == "process":
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = _now()
+        try:
+            yield
+        finally:
+            duration = _now() - started
+            if category == "process":
+                after = resource.getrusage(resource.RUSAGE_CHILDREN)
+                args["user"] = round(after.ru_utime - before.ru_utime, 6)
+                args["system"] = round(after.ru_stime - before.ru_stime, 6)
+            with cls._lock:
+                if cls.enabled:
+                    cls._emit({"name": name, "cat": category, "ph": "X",
+                               "ts": started, "dur": duration, "args": args})
+
+    @classmethod
+    def count(cls, name, value):
+        """Add value to the counter name, e.g. the bytes read from the
+        network"""
+        if not cls.enabled:
+            return
+        with cls._lock:
+            total, written = cls._counters.get(name, (0, 0))
+            total += value
+            now = _now()
+            cls._counters[name] = (total, written)
+            if now - written >= COUNTER_INTERVAL * 1e6:
+                cls._emit_counter(name, now)
+
+    @classmethod
+    def _emit_counter(cls, name, now=None):
+        now = _now() if now is None else now
+        total, _ = cls._counters[name]
+        cls._counters[name] = (total, now)
+        cls._emit({"name": name, "cat": "counter", "ph": "C", "ts": now,
+                   "args": {"value": total}})
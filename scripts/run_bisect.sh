@@ -14,7 +14,7 @@
 
 # this script is part of debbisect and usually called by debbisect itself
 #
-# it accepts six or eight arguments:
+# it accepts six, eight or nine arguments:
 #    1. dependencies
 #    2. script name or shell snippet
 #    3. mirror URL
@@ -22,7 +22,8 @@
 #    5. suite
 #    6. components
 #    7. (optional) second mirror URL
-#    8. (optional) package to upgrade
+#    8. (optional) comma separated list of packages to upgrade
+#    9. (optional) name of the package list (default: packages to upgrade)
 #
 # It will create an ephemeral chroot using mmdebstrap using (3.) as mirror,
 # (4.) as architecture, (5.) as suite and (6.) as components, install the
@@ -30,14 +31,24 @@
 # Its output is the exit code of the script as well as a file ./pkglist
 # containing the output of "dpkg-query -W" inside the chroot.
 #
-# If not only six but eight arguments are given, then the second mirror URL
-# (7.) will be added to the apt sources and the single package (8.) will be
-# upgraded to its version from (7.).
+# If not only six but eight or nine arguments are given, then the second
+# mirror URL (7.) will be added to the apt sources and the packages (8.) will
+# be upgraded to their version from (7.). The file with the output of
+# "dpkg-query -W" is then named after (9.).
+
+# If the environment variable DEBIAN_BISECT_CHROOT_BASE is set, then instead
+# of creating the chroot from scratch, the chroot tarball it points to (which
+# was created for an earlier timestamp) is unpacked and upgraded to (3.).
+# If the environment variable DEBIAN_BISECT_CHROOT_SAVE is set, then the
+# chroot is stored as a tarball at that location after the dependencies were
+# installed and before the script is run.
+# If the environment variable DEBIAN_BISECT_SCRIPT_STAMP is set, then the file
+# it points to is touched right before the script is run.
 
 set -exu
 
-if [ $# -ne 6 ] && [ $# -ne 8 ]; then
-	echo "usage: $0 depends script mirror1 architecture suite components [mirror2 toupgrade]"
+if [ $# -ne 6 ] && [ $# -ne 8 ] && [ $# -ne 9 ]; then
+	echo "usage: $0 depends script mirror1 architecture suite components [mirror2 toupgrade [pkglistname]]"
 	exit 1
 fi
 
@@ -47,41 +58,74 @@ mirror1=$3
 architecture=$4
 suite=$5
 components=$6
+nargs=$#
+if [ $# -ge 8 ]; then
+	mirror2=$7
+	toupgrade=$8
+	pkglistname=${9:-$toupgrade}
+fi
 
-if [ $# -eq 6 ]; then
+if [ -n "${DEBIAN_BISECT_SCRIPT_STAMP:-}" ]; then
+	stamphook='touch "'"$DEBIAN_BISECT_SCRIPT_STAMP"'"'
+else
+	stamphook=true
+fi
+
+# from here on, the positional arguments collect the options for mmdebstrap
+# which set up the chroot
+if [ -n "${DEBIAN_BISECT_CHROOT_BASE:-}" ]; then
+	set -- \
+		--variant=custom \
+		--skip=setup,update \
+		--setup-hook='tar-in "'"$DEBIAN_BISECT_CHROOT_BASE"'" /' \
+		--customize-hook='echo "deb '"$mirror1 $suite $(echo "$components" | tr ',' ' ')"'" > "$1"/etc/apt/sources.list' \
+		--customize-hook='chroot "$1" apt-get update' \
+		--customize-hook='chroot "$1" env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes dist-upgrade' \
+		--customize-hook='chroot "$1" env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes install --no-install-recommends '"$(echo "$depends" | tr ',' ' ')"
+else
+	set -- \
+		--variant=apt \
+		--include="$depends"
+fi
+if [ -n "${DEBIAN_BISECT_CHROOT_SAVE:-}" ]; then
+	set -- "$@" \
+		--customize-hook='chroot "$1" apt-get clean' \
+		--customize-hook='tar-out / "'"$DEBIAN_BISECT_CHROOT_SAVE.tmp"'"' \
+		--customize-hook='mv "'"$DEBIAN_BISECT_CHROOT_SAVE.tmp"'" "'"$DEBIAN_BISECT_CHROOT_SAVE"'"'
+fi
+
+if [ $nargs -eq 6 ]; then
 	mmdebstrap \
 		--verbose \
 		--aptopt='Acquire::Check-Valid-Until "false"' \
-		--variant=apt \
 		--components="$components" \
-		--include="$depends" \
 		--architecture="$architecture" \
+		"$@" \
 		--customize-hook='chroot "$1" sh -c "dpkg-query -W > /pkglist"' \
 		--customize-hook='download /pkglist ./debbisect.'"$DEBIAN_BISECT_TIMESTAMP"'.pkglist' \
 		--customize-hook='rm "$1"/pkglist' \
 		--customize-hook='chroot "$1" dpkg -l' \
+		--customize-hook="$stamphook" \
 		--customize-hook="$script" \
 		"$suite" \
 		- \
 		"$mirror1" \
 		>/dev/null
-elif [ $# -eq 8 ]; then
-	mirror2=$7
-	toupgrade=$8
+else
 	mmdebstrap \
 		--verbose \
 		--aptopt='Acquire::Check-Valid-Until "false"' \
-		--variant=apt \
 		--components="$components" \
-		--include="$depends" \
 		--architecture="$architecture" \
+		"$@" \
 		--customize-hook='echo "deb '"$mirror2 $suite $(echo "$components" | tr ',' ' ')"'" > "$1"/etc/apt/sources.list' \
 		--customize-hook='chroot "$1" apt-get update' \
-		--customize-hook='chroot "$1" env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes install --no-install-recommends '"$toupgrade" \
+		--customize-hook='chroot "$1" env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes install --no-install-recommends '"$(echo "$toupgrade" | tr ',' ' ')" \
 		--customize-hook='chroot "$1" sh -c "dpkg-query -W > /pkglist"' \
-		--customize-hook='download /pkglist ./debbisect.'"$DEBIAN_BISECT_TIMESTAMP.$toupgrade"'.pkglist' \
+		--customize-hook='download /pkglist ./debbisect.'"$DEBIAN_BISECT_TIMESTAMP.$pkglistname"'.pkglist' \
 		--customize-hook='rm "$1"/pkglist' \
 		--customize-hook='chroot "$1" dpkg -l' \
+		--customize-hook="$stamphook" \
 		--customize-hook="$script" \
 		"$suite" \
 		- \
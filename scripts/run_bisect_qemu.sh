@@ -14,7 +14,7 @@
 
 # this script is part of debbisect and usually called by debbisect itself
 #
-# it accepts eight or ten arguments:
+# it accepts eight, ten or eleven arguments:
 #    1. dependencies
 #    2. script name or shell snippet
 #    3. mirror URL
@@ -24,7 +24,8 @@
 #    7. memsize
 #    8. disksize
 #    9. (optional) second mirror URL
-#   10. (optional) package to upgrade
+#   10. (optional) comma separated list of packages to upgrade
+#   11. (optional) name of the package list (default: packages to upgrade)
 #
 # It will create an ephemeral qemu virtual machine using mmdebstrap and
 # guestfish using (3.) as mirror, (4.) as architecture, (5.) as suite and
@@ -33,14 +34,15 @@
 # Its output is the exit code of the script as well as a file ./pkglist
 # containing the output of "dpkg-query -W" inside the chroot.
 #
-# If not only six but eight arguments are given, then the second mirror URL
-# (9.) will be added to the apt sources and the single package (10.) will be
-# upgraded to its version from (9.).
+# If not only eight but ten or eleven arguments are given, then the second
+# mirror URL (9.) will be added to the apt sources and the packages (10.) will
+# be upgraded to their version from (9.). The file with the output of
+# "dpkg-query -W" is then named after (11.).
 
 set -exu
 
-if [ $# -ne 8 ] && [ $# -ne 10 ]; then
-	echo "usage: $0 depends script mirror1 architecture suite components memsize disksize [mirror2 toupgrade]"
+if [ $# -ne 8 ] && [ $# -ne 10 ] && [ $# -ne 11 ]; then
+	echo "usage: $0 depends script mirror1 architecture suite components memsize disksize [mirror2 toupgrade [pkglistname]]"
 	exit 1
 fi
 
@@ -53,9 +55,10 @@ components=$6
 memsize=$7
 disksize=$8
 
-if [ $# -eq 10 ]; then
+if [ $# -ge 10 ]; then
 	mirror2=$9
 	toupgrade=${10}
+	pkglistname=${11:-$toupgrade}
 fi
 
 case $architecture in
@@ -281,23 +284,23 @@ SCRIPT
 ssh -F "$TMPDIR/config" qemu apt-get update
 ssh -F "$TMPDIR/config" qemu env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes install --no-install-recommends $(echo $depends | tr ',' ' ')
 
-# in its ten-argument form, a single package has to be upgraded to its
-# version from the first bad timestamp
-if [ $# -eq 10 ]; then
+# in its ten- and eleven-argument form, the given packages have to be
+# upgraded to their version from the first bad timestamp
+if [ $# -ge 10 ]; then
 	# replace content of sources.list with first bad timestamp
 	mirror2=$(echo "$mirror2" | sed 's/http:\/\/127.0.0.1:/http:\/\/10.0.2.2:/')
 	echo "deb $mirror2 $suite $(echo "$components" | tr ',' ' ')" | ssh -F "$TMPDIR/config" qemu "cat > /etc/apt/sources.list"
 	ssh -F "$TMPDIR/config" qemu apt-get update
-	# upgrade a single package (and whatever else apt deems necessary)
+	# upgrade the packages (and whatever else apt deems necessary)
 	before=$(ssh -F "$TMPDIR/config" qemu dpkg-query -W)
-	ssh -F "$TMPDIR/config" qemu env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes install --no-install-recommends "$toupgrade"
+	ssh -F "$TMPDIR/config" qemu env DEBIAN_FRONTEND=noninteractive DEBCONF_NONINTERACTIVE_SEEN=true apt-get --yes install --no-install-recommends $(echo "$toupgrade" | tr ',' ' ')
 	after=$(ssh -F "$TMPDIR/config" qemu dpkg-query -W)
 	# make sure that something was upgraded
 	if [ "$before" = "$after" ]; then
 		echo "nothing got upgraded -- this should never happen" >&2
 		exit 1
 	fi
-	ssh -F "$TMPDIR/config" qemu dpkg-query -W > "./debbisect.$DEBIAN_BISECT_TIMESTAMP.$toupgrade.pkglist"
+	ssh -F "$TMPDIR/config" qemu dpkg-query -W > "./debbisect.$DEBIAN_BISECT_TIMESTAMP.$pkglistname.pkglist"
 else
 	ssh -F "$TMPDIR/config" qemu dpkg-query -W > "./debbisect.$DEBIAN_BISECT_TIMESTAMP.pkglist"
 fi
@@ -319,6 +322,11 @@ else
 fi
 
 
+# let debbisect know that the virtual machine is set up
+if [ -n "${DEBIAN_BISECT_SCRIPT_STAMP:-}" ]; then
+	touch "$DEBIAN_BISECT_SCRIPT_STAMP"
+fi
+
 # either execute $script as a script from $PATH or as a shell snippet
 ret=0
 if [ -x "$script" ] || echo "$script" | grep --invert-match --silent --perl-regexp '[^\w@\%+=:,.\/-]'; then